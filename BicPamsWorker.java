@@ -0,0 +1,61 @@
+/*
+ * @info long-lived BicPAMS worker, keeps a warm JVM between runs
+ * @author Francisco Neves
+ * @version 1.0
+ *
+ * Launched by bicpams_worker.py as: java -cp "bicpams.jar:lib/*" BicPamsWorker.java
+ *
+ * Protocol (stdin/stdout, one job at a time):
+ *   worker -> READY
+ *   python -> tab separated BicFranciscoTests arguments, one job per line
+ *   worker -> DONE <path of the .bics output>, read from disk by the caller
+ *          or ERROR <message>
+ */
+
+import java.io.BufferedReader;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.nio.charset.StandardCharsets;
+
+public class BicPamsWorker {
+
+    public static void main(String[] args) throws Exception {
+        PrintStream protocol = new PrintStream(new FileOutputStream(FileDescriptor.out), false, "UTF-8");
+        // The miner logs to System.out, keep stdout for the protocol only
+        System.setOut(System.err);
+
+        Method miner = Class.forName("tests.others.BicFranciscoTests").getMethod("main", String[].class);
+        BufferedReader jobs = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        protocol.print("READY\n");
+        protocol.flush();
+
+        String job;
+        while ((job = jobs.readLine()) != null) {
+            if (job.isEmpty()) {
+                continue;
+            }
+            String[] jobArgs = job.split("\t");
+            try {
+                miner.invoke(null, (Object) jobArgs);
+                protocol.print("DONE\t" + getOutputFile(jobArgs) + "\n");
+            } catch (Throwable e) {
+                Throwable cause = e instanceof InvocationTargetException ? e.getCause() : e;
+                protocol.print("ERROR\t" + String.valueOf(cause).replace('\n', ' ') + "\n");
+            }
+            protocol.flush();
+        }
+    }
+
+    private static String getOutputFile(String[] args) {
+        for (int i = 0; i < args.length - 1; i++) {
+            if (args[i].equals("--file_path")) {
+                return args[i + 1].split("\\.arff")[0] + ".bics";
+            }
+        }
+        throw new IllegalArgumentException("Missing --file_path");
+    }
+}
@@ -0,0 +1,88 @@
+'''
+@info alignment of the series of several sources onto a common time grid, filled per attribute family
+@author Francisco Neves
+@version 1.0
+'''
+
+import logging
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+import profiler
+from attribute_families import ATTRIBUTE_FAMILIES, get_attribute_family
+
+# Missing speeds mean free flow, the highest speed seen, missing delays, extensions and counts mean nothing happened
+FILL_POLICIES = {'speed': 'max', 'delay': 'zero', 'spatial_extension': 'zero', 'other': 'zero'}
+JOINS = ['inner', 'outer']
+
+logger = logging.getLogger('roadpm.alignment')
+
+
+def get_grid(indexes, how='inner'):
+    # Only the indexes are combined, the values of each source are copied once into the aligned block
+    if how not in JOINS:
+        raise ValueError('Unknown join {}, expected one of {}'.format(how, JOINS))
+    if how == 'inner':
+        return reduce(lambda grid, index: grid.intersection(index), indexes[1:], indexes[0]).sort_values()
+    return reduce(lambda grid, index: grid.union(index), indexes[1:], indexes[0]).sort_values()
+
+
+def fill(values, families, policies=FILL_POLICIES):
+    # One masked operation per family over its whole block of columns
+    families = np.asarray(families)
+    for family in ATTRIBUTE_FAMILIES:
+        columns = np.flatnonzero(families == family)
+        if not len(columns):
+            continue
+        block = values[:, columns]
+        missing = np.isnan(block)
+        if not missing.any():
+            continue
+        if policies[family] == 'max':
+            observed = ~missing.all(axis=0)
+            fallback = np.full(len(columns), np.nan)
+            fallback[observed] = np.nanmax(block[:, observed], axis=0)
+        elif policies[family] == 'zero':
+            fallback = np.zeros(len(columns))
+        else:
+            raise ValueError('Unknown fill policy {}'.format(policies[family]))
+        np.copyto(block, fallback, where=missing)
+        values[:, columns] = block
+    return values
+
+
+def align(sources, how='inner', policies=FILL_POLICIES):
+    # sources maps each source name to its time series, returns the aligned series and the coverage of each source
+    names = list(sources)
+    frames = [sources[name] for name in names]
+    columns = [column for frame in frames for column in frame.columns]
+    if len(set(columns)) != len(columns):
+        raise ValueError('Sources share attribute names: {}'.format(
+            sorted({column for column in columns if columns.count(column) > 1})))
+
+    grid = get_grid([frame.index for frame in frames], how)
+    # Column major, the blocks of each source and family are contiguous columns
+    values = np.full((len(grid), len(columns)), np.nan, order='F')
+    coverage = []
+    start = 0
+    for name, frame in zip(names, frames):
+        end = start + len(frame.columns)
+        positions = frame.index.get_indexer(grid)
+        present = positions >= 0
+        block = frame.to_numpy(dtype=float)[positions[present]]
+        values[present, start:end] = block
+        cells = len(grid) * len(frame.columns)
+        coverage.append({'source': name, 'columns': len(frame.columns), 'rows': len(frame),
+                         'grid_rows': round(present.mean(), 4) if len(grid) else 0.0,
+                         'observed_cells': round((block.size - np.isnan(block).sum()) / cells, 4) if cells else 0.0})
+        start = end
+
+    fill(values, [get_attribute_family(column) for column in columns], policies)
+    coverage = pd.DataFrame(coverage).set_index('source')
+    logger.info('Aligned %d sources on %d slots (%s join)\n%s', len(names), len(grid), how, coverage)
+    # Shown in the profile panel of the run next to the sizes of its loading stage
+    profiler.record(**{'{}_{}'.format(name, key): float(coverage.at[name, key]) for name in names for key in
+                       ['grid_rows', 'observed_cells']})
+    return pd.DataFrame(values, index=grid, columns=columns), coverage
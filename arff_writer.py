@@ -0,0 +1,47 @@
+'''
+@info streaming writer of numeric ARFF files for BicPAMS
+@author Francisco Neves
+@version 1.0
+'''
+
+import re
+
+import numpy as np
+
+# liac-arff wraps names holding any of these in double quotes, without escaping anything else
+QUOTE_CHARS = re.compile(r'[ %{},]')
+CHUNK_SIZE = 512
+
+
+def encode_name(name):
+    if QUOTE_CHARS.search(name):
+        return '"{}"'.format(name)
+    return name
+
+
+def get_arff_header(columns, relation='data'):
+    lines = ['@RELATION {}'.format(encode_name(relation)), '']
+    lines += ['@ATTRIBUTE {} NUMERIC'.format(encode_name(column)) for column in columns]
+    lines += ['', '@DATA', '']
+    return '\n'.join(lines)
+
+
+def encode_rows(values):
+    # repr gives the shortest round-trip representation, the same text liac-arff writes for each float
+    lines = [','.join(map(repr, row)) for row in values.tolist()]
+    return '\n'.join(lines).replace('nan', '?') + '\n'
+
+
+def write_arff(file, columns, values, relation='data', chunk_size=CHUNK_SIZE):
+    if isinstance(file, str):
+        with open(file, 'w') as f:
+            return write_arff(f, columns, values, relation, chunk_size)
+
+    values = np.asarray(values, dtype=float)
+    if values.ndim != 2 or values.shape[1] != len(columns):
+        raise ValueError('Expected a matrix with {} columns, got shape {}'.format(len(columns), values.shape))
+
+    file.write(get_arff_header(columns, relation))
+    for start in range(0, len(values), chunk_size):
+        file.write(encode_rows(values[start:start + chunk_size]))
+    file.flush()
@@ -0,0 +1,108 @@
+/* Chunked upload of large CSV files to the /upload endpoints (upload.py).
+ * The file is sent in slices so neither the browser nor the server holds it in memory,
+ * the stored path is then written into the dash input named by data-target. Progress and errors go to the
+ * .chunked-upload-progress element, which no dash callback updates, so React never overwrites them. */
+
+(function () {
+    var CHUNK_SIZE = 8 * 1024 * 1024;
+    var MAX_RETRIES = 3;
+
+    function setProgress(zone, text) {
+        var progress = zone.parentNode.querySelector('.chunked-upload-progress');
+        if (progress) {
+            progress.textContent = text;
+        }
+    }
+
+    function setDashValue(id, value) {
+        // React only notices value changes made through the native setter followed by an input event
+        var target = document.getElementById(id);
+        var setter = Object.getOwnPropertyDescriptor(window.HTMLInputElement.prototype, 'value').set;
+        setter.call(target, value);
+        target.dispatchEvent(new Event('input', {bubbles: true}));
+    }
+
+    function post(url, body) {
+        return fetch(url, {method: 'POST', body: body}).then(function (response) {
+            return response.json().then(function (json) {
+                json.status = response.status;
+                return json;
+            });
+        });
+    }
+
+    function sendChunks(zone, file, uploadId, offset, retries) {
+        if (offset >= file.size) {
+            return post('/upload/' + uploadId + '/finish');
+        }
+        var chunk = file.slice(offset, offset + CHUNK_SIZE);
+        return post('/upload/' + uploadId + '/chunk?offset=' + offset, chunk).then(function (res) {
+            if (res.status === 409 && retries < MAX_RETRIES) {
+                return sendChunks(zone, file, uploadId, res.size, retries + 1);
+            }
+            if (res.error) {
+                throw new Error(res.error);
+            }
+            setProgress(zone, file.name + ': ' + Math.floor(100 * res.size / file.size) + '%');
+            return sendChunks(zone, file, uploadId, res.size, 0);
+        }, function (error) {
+            if (retries < MAX_RETRIES) {
+                return sendChunks(zone, file, uploadId, offset, retries + 1);
+            }
+            throw error;
+        });
+    }
+
+    function upload(zone, file) {
+        setProgress(zone, file.name + ': 0%');
+        post('/upload/start?filename=' + encodeURIComponent(file.name) + '&size=' + file.size).then(function (res) {
+            if (res.error) {
+                throw new Error(res.error);
+            }
+            return sendChunks(zone, file, res.upload_id, 0, 0);
+        }).then(function (res) {
+            if (res.error) {
+                throw new Error(res.error);
+            }
+            setProgress(zone, '');
+            setDashValue(zone.getAttribute('data-target'), res.path);
+        }).catch(function (error) {
+            setProgress(zone, file.name + ': ' + error.message);
+        });
+    }
+
+    function getZone(event) {
+        return event.target.closest ? event.target.closest('.chunked-upload') : null;
+    }
+
+    // Upload zones are rendered by dash after the page loads, events are handled at the document level
+    document.addEventListener('click', function (event) {
+        var zone = getZone(event);
+        if (!zone) {
+            return;
+        }
+        var input = document.createElement('input');
+        input.type = 'file';
+        input.accept = '.csv';
+        input.addEventListener('change', function () {
+            if (input.files.length) {
+                upload(zone, input.files[0]);
+            }
+        });
+        input.click();
+    });
+
+    document.addEventListener('dragover', function (event) {
+        if (getZone(event)) {
+            event.preventDefault();
+        }
+    });
+
+    document.addEventListener('drop', function (event) {
+        var zone = getZone(event);
+        if (zone && event.dataTransfer.files.length) {
+            event.preventDefault();
+            upload(zone, event.dataTransfer.files[0]);
+        }
+    });
+})();
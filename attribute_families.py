@@ -0,0 +1,16 @@
+'''
+@info families of the series and transaction columns, shared by the alignment of sources and the bicluster index
+@author Francisco Neves
+@version 1.0
+'''
+
+import re
+
+ATTRIBUTE_FAMILIES = ['speed', 'delay', 'spatial_extension', 'other']
+HOUR_PATTERN = re.compile(r'(\d{2}):(\d{2})')
+
+
+def get_attribute_family(column):
+    # Columns are <attribute>_<HH:MM> or <HH:MM>_<attribute>, loop counts and others fall in 'other'
+    attribute = HOUR_PATTERN.sub('', column).strip('_')
+    return next((family for family in ATTRIBUTE_FAMILIES[:-1] if attribute.startswith(family)), 'other')
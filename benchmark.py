@@ -0,0 +1,335 @@
+'''
+@info benchmarks for the biclustering pipeline
+@author Francisco Neves
+@version 1.0
+'''
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from bicluster_index import build_index
+from roadpm_utils import reshape_data, get_missing_value, build_transaction_matrix, parse_bics_from_file, \
+    parse_string_list, bicpams_parameters, get_output_file, Biclustering
+
+STAGES = ['reshape_data', 'transaction_matrix', 'export_transactions', 'bicpams', 'parse_bics', 'get_visualization',
+          'bicluster_index']
+# Headless use of the pipeline must not pull in the visualization and GUI dependencies, the pages may
+CORE_MODULES = ['roadpm_utils', 'bicluster', 'bicluster_index', 'attribute_families', 'ingestion', 'event_store',
+                'rollups', 'alignment']
+PAGE_MODULES = ['roadpm', 'roadpm_from_csv']
+GUI_MODULES = ['plotly', 'dash', 'dash_core_components', 'dash_html_components', 'dash_table', 'folium', 'branca',
+               'flask', 'shapely']
+IMPORT_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'time': time.perf_counter() - start,
+                  'modules': sorted({{name.split('.')[0] for name in sys.modules}} & set({gui_modules}))}}))
+'''
+
+
+def get_daily_profile(index):
+    # Morning and evening peaks, weekends are quieter
+    hours = index.hour + index.minute / 60
+    peaks = np.exp(-(hours - 8.5) ** 2 / 2) + np.exp(-(hours - 18) ** 2 / 3)
+    return np.where(index.dayofweek < 5, peaks, 0.4 * peaks)
+
+
+def get_synthetic_series(num_days, num_locations, granularity, dataset='waze', seed=0):
+    index = pd.date_range('2018-10-17', periods=num_days * 24 * 60 // granularity, freq='{}min'.format(granularity))
+    profile = get_daily_profile(index)
+    rng = np.random.default_rng(seed)
+    data = {}
+    if dataset in ('waze', 'integrative'):
+        for location in range(num_locations):
+            free_flow = rng.uniform(12, 17)
+            jams = rng.random(len(index)) < 0.05 + 0.5 * profile * rng.uniform(0.5, 1)
+            data['speed_road{}'.format(location)] = np.where(jams, rng.uniform(1, 0.7 * free_flow, len(index)),
+                                                             free_flow).round(3)
+            data['delay_road{}'.format(location)] = np.where(jams, rng.exponential(120, len(index)), 0).round(1)
+            data['spatial_extension_road{}'.format(location)] = np.where(jams, rng.exponential(400, len(index)),
+                                                                         0).round(1)
+    if dataset in ('espiras', 'integrative'):
+        for location in range(num_locations):
+            # Vehicles counted by each loop detector per time slot
+            rate = rng.uniform(50, 400) * granularity / 15
+            data['espira{}'.format(location)] = rng.poisson(rate * (0.1 + profile)).astype(float)
+    return pd.DataFrame(data, index=index)
+
+
+def legacy_transaction_matrix(series, dataset):
+    # row-wise reshape and per-attribute pivots, as originally done by Biclustering.export_transactions
+    transactions = series.copy()
+    transactions['Day'] = transactions.apply(lambda x: x.name.strftime('%Y-%m-%d'), axis=1)
+    transactions['Hour'] = transactions.apply(lambda x: x.name.strftime('%H:%M'), axis=1)
+
+    data = None
+    for attr in series.columns:
+        new_columns = transactions.pivot(index='Day', columns='Hour', values=attr)
+        new_columns = new_columns.replace(get_missing_value(series, attr), np.nan)
+        if dataset != 'integrative' and attr.startswith(('speed', 'spatial_extension', 'delay')):
+            new_columns = new_columns.add_prefix('{}_'.format(attr))
+        else:
+            new_columns = new_columns.add_suffix('_{}'.format(attr))
+        data = new_columns if data is None else pd.concat([data, new_columns], axis=1, sort=False)
+    return data.reindex(sorted(data.columns), axis=1)
+
+
+def legacy_parse_bics_from_file(file_path):
+    # single regex over the whole file, as originally done by parse_bics_from_file
+    with open(file_path, 'r') as f:
+        contents = f.read()
+    matches = re.findall(
+        r'I=(\[.+\]) \(\d+,\d+\) Y=(\[.*\]) X=(\[[\d,]*\]) pvalue=([\d.E-]+) area=([\d.E-]+)\n(([-\d:.]+[\s]{0,1})*)\n(([-\d:.]+[\s]{0,3})*)',
+        contents)
+    return [{'cols': parse_string_list(cols), 'real_matrix': legacy_parse_matrix(real_matrix),
+             'matrix': legacy_parse_matrix(matrix), 'pvalue': pvalue, 'area': area} for
+            _, cols, _, pvalue, area, real_matrix, _, matrix, _ in matches]
+
+
+def legacy_parse_matrix(matrix):
+    lines = matrix.split('\n')[:-3]
+    return [line.split('\t')[1:] for line in lines]
+
+
+def to_float_matrix(matrix):
+    width = max((len(row) for row in matrix), default=0)
+    cells = [[float(value or 'nan') for value in row] + [np.nan] * (width - len(row)) for row in matrix]
+    return np.array(cells, dtype=float).reshape(len(matrix), width)
+
+
+def timeit(func, *args):
+    start = time.perf_counter()
+    res = func(*args)
+    return res, time.perf_counter() - start
+
+
+def benchmark_transaction_matrix(series, dataset):
+    legacy, legacy_time = timeit(legacy_transaction_matrix, series, dataset)
+    vectorized, vectorized_time = timeit(build_transaction_matrix, series, dataset)
+    _, reshape_time = timeit(reshape_data, series)
+
+    assert list(legacy.columns) == list(vectorized.columns)
+    assert list(legacy.index) == list(vectorized.index)
+    np.testing.assert_array_equal(legacy.to_numpy(dtype=float), vectorized.to_numpy())
+
+    print('Series: {} rows x {} columns'.format(*series.shape))
+    print('Transactions: {} days x {} columns'.format(*vectorized.shape))
+    print('reshape_data: {:.3f}s'.format(reshape_time))
+    print('legacy: {:.3f}s, vectorized: {:.3f}s, speedup: {:.1f}x'.format(
+        legacy_time, vectorized_time, legacy_time / vectorized_time))
+
+
+def legacy_parse_numeric_bics_from_file(file_path):
+    bics = legacy_parse_bics_from_file(file_path)
+    return [dict(bic, real_matrix=to_float_matrix(bic['real_matrix']), matrix=to_float_matrix(bic['matrix'])) for
+            bic in bics]
+
+
+def check_bics_parser(file_path):
+    # regression check against the original regex parser, also run by test_bics_parser.py on data/bics/
+    legacy, legacy_time = timeit(legacy_parse_numeric_bics_from_file, file_path)
+    streaming, streaming_time = timeit(parse_bics_from_file, file_path)
+
+    assert len(legacy) == len(streaming)
+    for old, new in zip(legacy, streaming):
+        assert old['cols'] == new.cols
+        assert float(old['pvalue']) == new.pvalue and float(old['area']) == new.area
+        assert new.real_matrix.shape == new.matrix.shape == (len(new.rows), len(new.cols))
+        np.testing.assert_array_equal(old['matrix'].astype(np.float32), new.get_values('matrix'))
+        # The original parser lost the last two rows of every real matrix
+        real_rows = len(old['real_matrix'])
+        assert real_rows == max(0, len(new.rows) - 2)
+        if real_rows:
+            np.testing.assert_array_equal(old['real_matrix'].astype(np.float32), new.get_values('real_matrix')[:real_rows])
+    return streaming, legacy_time, streaming_time
+
+
+def benchmark_bics_parser(file_path):
+    streaming, legacy_time, streaming_time = check_bics_parser(file_path)
+    print('{}: {} biclusters'.format(file_path, len(streaming)))
+    print('legacy: {:.3f}s, streaming: {:.3f}s, speedup: {:.1f}x'.format(
+        legacy_time, streaming_time, legacy_time / streaming_time))
+
+
+def get_default_parameters():
+    params = {}
+    for param in itertools.chain(*bicpams_parameters.values()):
+        params[param['name']] = param['options'][0] if 'options' in param else param['default']
+    return params
+
+
+class StageTimer:
+    # Progress callback splitting a BicPAMS run into mining and parsing time
+    def __init__(self):
+        self.times = {}
+
+    def __call__(self, stage):
+        self.times[stage] = time.perf_counter()
+
+
+def benchmark_pipeline(series, dataset, params, run_bicpams=True):
+    timings, sizes = {}, {}
+    _, timings['reshape_data'] = timeit(reshape_data, series)
+
+    method = Biclustering(series, params, dataset)
+    data, timings['transaction_matrix'] = timeit(method.get_transaction_matrix)
+    sizes['series'] = list(series.shape)
+    sizes['transaction_matrix'] = list(data.shape)
+
+    bics = []
+    with tempfile.TemporaryDirectory() as directory:
+        arff_file, timings['export_transactions'] = timeit(method.export_transactions,
+                                                           os.path.join(directory, 'benchmark.arff'))
+        sizes['arff_bytes'] = os.path.getsize(arff_file)
+
+        if run_bicpams:
+            timer = StageTimer()
+            start = time.perf_counter()
+            bics = method.bicpams_wrapper.run(arff_file, params, progress=timer, shape=data.shape)
+            end = time.perf_counter()
+            timings['bicpams'] = timer.times.get('parsing', end) - timer.times.get('mining', start)
+            timings['parse_bics'] = end - timer.times.get('parsing', end)
+            if os.path.exists(get_output_file(arff_file)):
+                sizes['bics_bytes'] = os.path.getsize(get_output_file(arff_file))
+                _, timings['parse_bics'] = timeit(parse_bics_from_file, get_output_file(arff_file))
+
+        # Biclusters are kept server-side in the index the pages filter and draw from
+        index_file = os.path.join(directory, 'benchmark.npz')
+        _, timings['bicluster_index'] = timeit(build_index, bics, index_file)
+        sizes['bicluster_index_bytes'] = os.path.getsize(index_file)
+    sizes['bics'] = len(bics)
+
+    _, timings['get_visualization'] = timeit(method.get_visualization)
+
+    return timings, sizes
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_config_key(config):
+    return '{dataset}-{days}d-{locations}l-{granularity}min'.format(**config)
+
+
+def run_suite(datasets, days, locations, granularities, run_bicpams=True, repeat=1):
+    params = get_default_parameters()
+    results = []
+    for dataset, num_days, num_locations, granularity in itertools.product(datasets, days, locations, granularities):
+        config = {'dataset': dataset, 'days': num_days, 'locations': num_locations, 'granularity': granularity}
+        series = get_synthetic_series(num_days, num_locations, granularity, dataset)
+        # The fastest of the repetitions is kept, it is the least affected by noise
+        runs = [benchmark_pipeline(series, dataset, params, run_bicpams) for _ in range(repeat)]
+        timings = {stage: min(run[0][stage] for run in runs) for stage in runs[0][0]}
+        sizes = runs[0][1]
+        results.append({'name': get_config_key(config), 'config': config, 'timings': timings, 'sizes': sizes})
+        print('{}: {}'.format(results[-1]['name'], ', '.join(
+            '{} {:.3f}s'.format(stage, timings[stage]) for stage in STAGES if stage in timings)))
+
+    return {'commit': get_commit(), 'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0],
+            'platform': platform.platform(), 'parameters': params, 'results': results}
+
+
+def benchmark_import(module, repeat=3):
+    # Every import runs in a fresh interpreter, nothing is cached in sys.modules
+    directory = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [directory, os.environ.get('PYTHONPATH')])))
+    runs = [json.loads(subprocess.check_output(
+        [sys.executable, '-c', IMPORT_SCRIPT.format(module=module, gui_modules=GUI_MODULES)], cwd=directory,
+        env=env).decode().splitlines()[-1]) for _ in range(repeat)]
+    return min(run['time'] for run in runs), runs[0]['modules']
+
+
+def run_import_suite(repeat=3):
+    imports, violations = {}, []
+    for module in CORE_MODULES + PAGE_MODULES:
+        imports[module], loaded = benchmark_import(module, repeat)
+        print('import {}: {:.3f}s{}'.format(module, imports[module], ' ({})'.format(', '.join(loaded)) if loaded else ''))
+        if module in CORE_MODULES and loaded:
+            violations.append((module, loaded))
+    for module, loaded in violations:
+        print('Import violation: {} loads {}'.format(module, ', '.join(loaded)))
+    return imports, violations
+
+
+def compare_reports(report, baseline, tolerance):
+    # Stages slower than the baseline by more than the tolerance are reported as regressions
+    baseline_results = {result['name']: result['timings'] for result in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        previous = baseline_results.get(result['name'])
+        if previous is None:
+            continue
+        for stage in STAGES:
+            if stage in result['timings'] and previous.get(stage):
+                ratio = result['timings'][stage] / previous[stage]
+                print('{} {}: {:.3f}s -> {:.3f}s ({:.2f}x)'.format(result['name'], stage, previous[stage],
+                                                                  result['timings'][stage], ratio))
+                if ratio > 1 + tolerance:
+                    regressions.append((result['name'], stage, ratio))
+    for module, seconds in report.get('imports', {}).items():
+        previous = baseline.get('imports', {}).get(module)
+        if previous:
+            print('import {}: {:.3f}s -> {:.3f}s ({:.2f}x)'.format(module, previous, seconds, seconds / previous))
+            if seconds / previous > 1 + tolerance:
+                regressions.append(('import', module, seconds / previous))
+    for name, stage, ratio in regressions:
+        print('Regression: {} {} is {:.2f}x slower than {}'.format(name, stage, ratio, baseline.get('commit')))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, nargs='+', default=[7, 90, 365])
+    parser.add_argument('--locations', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--granularity', type=int, nargs='+', default=[15], choices=[15, 30, 60])
+    parser.add_argument('--dataset', nargs='+', default=['waze'], choices=['waze', 'espiras', 'integrative'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-bicpams', action='store_true', help='do not run the jar, e.g. when Java is missing')
+    parser.add_argument('--report', help='write the timings to this JSON file')
+    parser.add_argument('--compare', help='JSON report of a previous commit to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown before flagging a regression')
+    parser.add_argument('--legacy', action='store_true', help='check the vectorized code against the original one')
+    parser.add_argument('--bics', nargs='*', default=[], help='recorded .bics files to check the parser against')
+    parser.add_argument('--imports-only', action='store_true', help='only time the imports of the modules')
+    args = parser.parse_args()
+
+    if args.legacy:
+        for dataset in args.dataset:
+            benchmark_transaction_matrix(
+                get_synthetic_series(args.days[-1], args.locations[-1], args.granularity[0], dataset), dataset)
+    for bics_file in args.bics:
+        benchmark_bics_parser(bics_file)
+
+    imports, violations = run_import_suite(args.repeat)
+    if args.imports_only:
+        report = {'commit': get_commit(), 'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': []}
+    else:
+        report = run_suite(args.dataset, args.days, args.locations, args.granularity, not args.skip_bicpams,
+                           args.repeat)
+    report['imports'] = imports
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            if compare_reports(report, json.load(f), args.tolerance):
+                sys.exit(1)
+    if violations:
+        sys.exit(1)
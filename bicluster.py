@@ -0,0 +1,46 @@
+'''
+@info compact numeric representation of BicPAMS biclusters
+@author Francisco Neves
+@version 1.0
+'''
+
+import numpy as np
+
+MISSING_LABEL = np.iinfo(np.int8).min
+
+
+def to_discrete(matrix):
+    # Discrete labels fit in int8, anything else is kept as float32
+    matrix = np.asarray(matrix, dtype=float)
+    labels = matrix[~np.isnan(matrix)]
+    if np.all(labels == np.round(labels)) and np.all(np.abs(labels) < abs(MISSING_LABEL)):
+        return np.where(np.isnan(matrix), MISSING_LABEL, matrix).astype(np.int8)
+    return matrix.astype(np.float32)
+
+
+def get_bounds(values):
+    values = values[~np.isnan(values)]
+    if values.size == 0:
+        return np.nan, np.nan
+    return float(values.min()), float(values.max())
+
+
+class Bicluster:
+    def __init__(self, cols, rows, real_matrix, matrix, pvalue, area):
+        self.cols = list(cols)
+        self.rows = np.asarray(rows, dtype=np.int32)
+        self.real_matrix = np.asarray(real_matrix, dtype=np.float32)
+        self.matrix = matrix if np.asarray(matrix).dtype == np.int8 else to_discrete(matrix)
+        self.pvalue = float(pvalue)
+        self.area = float(area)
+        self.num_rows = len(self.real_matrix)
+        self.num_cols = len(self.cols)
+        self.bounds = {'real_matrix': get_bounds(self.get_values('real_matrix')),
+                       'matrix': get_bounds(self.get_values('matrix'))}
+
+    def get_values(self, matrix_type):
+        if matrix_type == 'real_matrix':
+            return self.real_matrix
+        if self.matrix.dtype == np.int8:
+            return np.where(self.matrix == MISSING_LABEL, np.nan, self.matrix).astype(np.float32)
+        return self.matrix
@@ -0,0 +1,115 @@
+'''
+@info columnar index of biclusters for fast filtering, matrices are only loaded for the selected biclusters
+@author Francisco Neves
+@version 1.0
+'''
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from attribute_families import ATTRIBUTE_FAMILIES, HOUR_PATTERN, get_attribute_family
+from bicluster import Bicluster
+
+SORT_COLUMNS = ['index', 'pvalue', 'area', 'num_rows', 'num_cols']
+PVALUE_FILTER = re.compile(r'^p\s*<\s*([\d.eE+-]+)$')
+HOURS_FILTER = re.compile(r'^(\d{1,2}:\d{2})\s*-\s*(\d{1,2}:\d{2})$')
+
+
+def to_minutes(hour):
+    hours, minutes = hour.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def get_metadata(bic):
+    minutes = [to_minutes(match.group(0)) for match in map(HOUR_PATTERN.search, bic.cols) if match]
+    families = {get_attribute_family(col) for col in bic.cols}
+    metadata = {'pvalue': bic.pvalue, 'area': bic.area, 'num_rows': bic.num_rows, 'num_cols': bic.num_cols,
+                'start_minute': min(minutes, default=-1), 'end_minute': max(minutes, default=-1)}
+    metadata.update({family: family in families for family in ATTRIBUTE_FAMILIES})
+    return metadata
+
+
+def build_index(bics, path, token=None):
+    arrays = {}
+    for i, bic in enumerate(bics):
+        arrays['cols_{}'.format(i)] = np.array(bic.cols, dtype=str)
+        arrays['rows_{}'.format(i)] = bic.rows
+        arrays['real_matrix_{}'.format(i)] = bic.real_matrix
+        arrays['matrix_{}'.format(i)] = bic.matrix
+    np.savez(path, **arrays)
+
+    columns = ['pvalue', 'area', 'num_rows', 'num_cols', 'start_minute', 'end_minute'] + ATTRIBUTE_FAMILIES
+    return BiclusterIndex(pd.DataFrame([get_metadata(bic) for bic in bics], columns=columns), path, token)
+
+
+def parse_filter(text):
+    # e.g. "p < 1e-3, 08:00-10:00, speed"
+    filters = {'families': []}
+    for token in filter(None, (token.strip() for token in (text or '').split(','))):
+        pvalue, hours = PVALUE_FILTER.match(token), HOURS_FILTER.match(token)
+        if pvalue:
+            filters['max_pvalue'] = float(pvalue.group(1))
+        elif hours:
+            filters['hours'] = (hours.group(1), hours.group(2))
+        elif token in ATTRIBUTE_FAMILIES:
+            filters['families'].append(token)
+        else:
+            raise ValueError('Unknown bicluster filter: {}'.format(token))
+    return filters
+
+
+class BiclusterIndex:
+    def __init__(self, metadata, path, token=None):
+        self.metadata = metadata
+        self.path = path
+        self.token = token
+
+    def __len__(self):
+        return len(self.metadata)
+
+    def filter(self, max_pvalue=None, hours=None, families=None):
+        selected = np.ones(len(self.metadata), dtype=bool)
+        if max_pvalue is not None:
+            selected &= self.metadata['pvalue'].to_numpy() < max_pvalue
+        if hours is not None:
+            # Biclusters with at least one column inside the interval
+            start, end = to_minutes(hours[0]), to_minutes(hours[1])
+            selected &= (self.metadata['start_minute'].to_numpy() <= end) & (
+                    self.metadata['end_minute'].to_numpy() >= start)
+        if families:
+            # Biclusters only made of columns of the given attribute families
+            others = [family for family in ATTRIBUTE_FAMILIES if family not in families]
+            selected &= ~self.metadata[others].to_numpy().any(axis=1)
+        return np.flatnonzero(selected)
+
+    def sort(self, positions, by='index'):
+        if by == 'index':
+            return positions
+        values = self.metadata[by].to_numpy()[positions]
+        # Significance sorts ascending, sizes descending
+        order = np.argsort(values if by == 'pvalue' else -values, kind='stable')
+        return positions[order]
+
+    def get(self, position):
+        # None once the matrices were evicted from the session store, the index may outlive them in memory
+        try:
+            data = np.load(self.path)
+        except FileNotFoundError:
+            return None
+        with data:
+            return Bicluster(data['cols_{}'.format(position)].tolist(), data['rows_{}'.format(position)],
+                             data['real_matrix_{}'.format(position)], data['matrix_{}'.format(position)],
+                             self.metadata['pvalue'].iat[position], self.metadata['area'].iat[position])
+
+    def get_summary(self):
+        pvalues = self.metadata['pvalue']
+        return {'num_bics': len(self.metadata),
+                'p_value_high': int((pvalues > 0.01).sum()),
+                'p_value_interval': int(pvalues.between(1e-3, 0.1).sum()),
+                'p_value_low': int((pvalues < 1e-3).sum()),
+                'num_rows_mean': self.metadata['num_rows'].mean(),
+                'num_rows_stdev': self.metadata['num_rows'].std(),
+                'num_cols_mean': self.metadata['num_cols'].mean(),
+                'num_cols_stdev': self.metadata['num_cols'].std()}
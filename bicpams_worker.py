@@ -0,0 +1,203 @@
+'''
+@info pool of long-lived BicPAMS JVMs, avoids paying JVM startup and warm-up on every run
+@author Francisco Neves
+@version 1.0
+'''
+
+import os
+import subprocess
+import threading
+import time
+
+import profiler
+import scheduler
+
+JAR_DIRECTORY = str(os.path.abspath(os.path.dirname(__file__)))
+CLASSPATH = os.pathsep.join(['bicpams.jar', os.path.join('lib', '*')])
+WORKER_SOURCE = 'BicPamsWorker.java'
+MAX_JOBS_PER_WORKER = 50
+# JVMs keep their heap between runs, those with more than the smallest heap are stopped after idling this long (seconds)
+IDLE_TIMEOUT = int(os.environ.get('ROADPM_BICPAMS_IDLE_TIMEOUT', 300))
+
+
+class WorkerError(Exception):
+    pass
+
+
+class WorkerUnavailable(WorkerError):
+    pass
+
+
+class WorkerCrashed(WorkerError):
+    pass
+
+
+class BicPamsWorker:
+    def __init__(self, max_jobs=MAX_JOBS_PER_WORKER):
+        self.max_jobs = max_jobs
+        self.process = None
+        self.jobs_done = 0
+        self.runs = 0
+        self.heap = None
+        self.interrupted = False
+        self.lock = threading.Lock()
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self, heap=None):
+        start = time.perf_counter()
+        self.heap = heap or scheduler.MIN_HEAP
+        heap_option = ['-Xmx{}m'.format(self.heap)]
+        try:
+            self.process = subprocess.Popen(['java'] + heap_option + ['-cp', CLASSPATH, WORKER_SOURCE],
+                                            cwd=JAR_DIRECTORY, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        except OSError as e:
+            raise WorkerUnavailable(str(e))
+        if self.process.stdout.readline().strip() != b'READY':
+            self.stop()
+            raise WorkerUnavailable('BicPAMS worker failed to start')
+        self.jobs_done = 0
+        profiler.record(jvm_startups=1, jvm_startup_time=round(time.perf_counter() - start, 4))
+
+    def warm_up(self, heap=None):
+        with self.lock:
+            if not self.is_alive():
+                try:
+                    self.start(heap)
+                except WorkerUnavailable:
+                    pass
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+    def stop_if_idle(self, runs):
+        # Nothing ran since the timer was set, the heap is given back
+        if self.lock.acquire(blocking=False):
+            try:
+                if self.runs == runs:
+                    self.stop()
+            finally:
+                self.lock.release()
+
+    def interrupt(self):
+        # Called from another thread to stop the job being run, the worker starts again on its next job
+        self.interrupted = True
+        process = self.process
+        if process is not None:
+            process.kill()
+
+    def submit(self, args, heap=None):
+        # Recycle workers periodically so state leaked by the miner does not accumulate, or to change their heap
+        heap = heap or scheduler.MIN_HEAP
+        if not self.is_alive() or self.jobs_done >= self.max_jobs or heap != self.heap:
+            self.stop()
+            self.start(heap)
+            if self.interrupted:
+                # Interrupted while the JVM was being replaced, before it could be killed
+                self.stop()
+                raise WorkerCrashed('BicPAMS worker was interrupted')
+
+        try:
+            with profiler.sample_rss(self.process.pid):
+                self.process.stdin.write(('\t'.join(args) + '\n').encode('utf-8'))
+                self.process.stdin.flush()
+                header = self.process.stdout.readline()
+        except OSError:
+            header = b''
+        if not header:
+            self.stop()
+            raise WorkerCrashed('BicPAMS worker exited while running a job')
+
+        status, _, value = header.decode('utf-8').rstrip('\r\n').partition('\t')
+        self.jobs_done += 1
+        if status == 'ERROR':
+            raise WorkerError(value)
+        # The output stays on disk, it is parsed as a stream instead of being sent through the pipe
+        return os.path.join(JAR_DIRECTORY, value)
+
+    def run(self, args, retries=1, heap=None, watch=None):
+        with self.lock:
+            self.interrupted = False
+            if watch is not None:
+                watch(self.interrupt)
+            try:
+                for attempt in range(retries + 1):
+                    try:
+                        return self.submit(args, heap)
+                    except WorkerCrashed:
+                        if self.interrupted or attempt == retries:
+                            raise
+            finally:
+                if watch is not None:
+                    watch(None)
+                self.runs += 1
+                # Larger heaps wait for the next run of their size for a while, then are given back
+                if self.heap is not None and self.heap > scheduler.MIN_HEAP:
+                    timer = threading.Timer(IDLE_TIMEOUT, self.stop_if_idle, [self.runs])
+                    timer.daemon = True
+                    timer.start()
+
+
+class BicPamsWorkerPool:
+    def __init__(self, size):
+        self.idle = []
+        self.size = 0
+        self.condition = threading.Condition()
+        self.grow(size)
+
+    def grow(self, size):
+        # Workers start lazily, growing the pool is cheap
+        with self.condition:
+            while self.size < size:
+                self.idle.append(BicPamsWorker())
+                self.size += 1
+            self.condition.notify_all()
+
+    def acquire(self, heap):
+        # A JVM already running with the heap of the run is reused, otherwise one that is not running, then the one
+        # idle for the longest time
+        with self.condition:
+            while not self.idle:
+                self.condition.wait()
+            worker = next((worker for worker in self.idle if worker.heap == heap and worker.is_alive()), None) or \
+                next((worker for worker in self.idle if not worker.is_alive()), self.idle[0])
+            self.idle.remove(worker)
+            return worker
+
+    def release(self, worker):
+        with self.condition:
+            self.idle.append(worker)
+            self.condition.notify()
+
+    def run(self, args, heap=None, watch=None):
+        worker = self.acquire(heap or scheduler.MIN_HEAP)
+        try:
+            return worker.run(args, heap=heap, watch=watch)
+        finally:
+            self.release(worker)
+
+    def warm_up(self):
+        for worker in list(self.idle):
+            threading.Thread(target=worker.warm_up, daemon=True).start()
+
+    def stop(self):
+        for worker in list(self.idle):
+            worker.stop()
+
+
+worker_pool = None
+worker_pool_lock = threading.Lock()
+
+
+def get_worker_pool(size):
+    global worker_pool
+    with worker_pool_lock:
+        if worker_pool is None:
+            worker_pool = BicPamsWorkerPool(size)
+        else:
+            worker_pool.grow(size)
+    return worker_pool
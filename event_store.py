@@ -0,0 +1,167 @@
+'''
+@info local store of waze jams and loop counts, partitioned by day and location so queries only read what they need
+@author Francisco Neves
+@version 1.0
+'''
+
+import argparse
+import json
+import os
+import tempfile
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pandas as pd
+
+import profiler
+
+EVENTS_PATH = os.environ.get('ROADPM_EVENTS_PATH',
+                             str(os.path.abspath(os.path.dirname(__file__))) + '/data/events/')
+# Column holding the location of each record, it is kept in the partition name instead of the files
+LOCATION_COLUMNS = {'waze': 'street_name', 'espiras': 'espira'}
+TIME_COLUMN = 'time'
+PARTITION_EXTENSION = '.npz'
+
+
+def get_weekdays(days):
+    # days as built by the pages from gui_utils.get_calendar_days: ['all'] or [[1, 2, ...]] (Monday is 1)
+    while isinstance(days, (list, tuple)) and len(days) == 1 and isinstance(days[0], (list, tuple, range, str)):
+        days = days[0]
+    if days is None or days == 'all':
+        return None
+    return {int(day) for day in days}
+
+
+def get_dates(start_date, end_date, days=None):
+    # Calendar filters are resolved to the partitions to read, before touching the disk
+    dates = pd.date_range(pd.Timestamp(start_date).normalize(), pd.Timestamp(end_date).normalize(), freq='D')
+    weekdays = get_weekdays(days)
+    if weekdays is not None:
+        dates = dates[np.isin(dates.dayofweek + 1, list(weekdays))]
+    return list(dates.strftime('%Y-%m-%d'))
+
+
+def to_storable(values):
+    # Partitions are read without pickle, text columns are kept as fixed width strings
+    values = np.asarray(values)
+    return values.astype(str) if values.dtype == object else values
+
+
+class EventStore:
+    def __init__(self, directory=EVENTS_PATH):
+        self.directory = directory
+
+    def get_day_path(self, source, day):
+        return os.path.join(self.directory, source, day)
+
+    def get_partition_path(self, source, day, location):
+        return os.path.join(self.get_day_path(source, day), quote(str(location), safe='') + PARTITION_EXTENSION)
+
+    def write_partition(self, source, day, location, columns):
+        path = self.get_partition_path(source, day, location)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.tmp', delete=False) as f:
+            np.savez(f, **columns)
+        os.replace(f.name, path)
+
+    def write(self, source, records):
+        # Records are split by day and location, existing partitions are replaced
+        location_column = LOCATION_COLUMNS[source]
+        times = pd.DatetimeIndex(records[TIME_COLUMN])
+        keys = pd.DataFrame({'day': times.strftime('%Y-%m-%d'), 'location': records[location_column].to_numpy()})
+        columns = [column for column in records.columns if column != location_column]
+        for (day, location), positions in keys.groupby(['day', 'location']).indices.items():
+            part = records.iloc[positions]
+            self.write_partition(source, day, location, {column: to_storable(part[column]) for column in columns})
+
+    def get_partitions(self, source, start_date, end_date, days=None, locations=None):
+        partitions = []
+        for day in get_dates(start_date, end_date, days):
+            day_path = self.get_day_path(source, day)
+            if locations is not None:
+                paths = [self.get_partition_path(source, day, location) for location in locations]
+                partitions += [(location, path) for location, path in zip(locations, paths) if os.path.exists(path)]
+            elif os.path.isdir(day_path):
+                partitions += [(unquote(name[:-len(PARTITION_EXTENSION)]), os.path.join(day_path, name)) for name in
+                               sorted(os.listdir(day_path)) if name.endswith(PARTITION_EXTENSION)]
+        return partitions
+
+    def get_days(self, source):
+        path = os.path.join(self.directory, source)
+        return sorted(day for day in os.listdir(path) if not day.endswith('.tmp')) if os.path.isdir(path) else []
+
+    def read_partition(self, source, location, path, columns=None):
+        with np.load(path) as data:
+            part = pd.DataFrame({column: data[column] for column in [TIME_COLUMN] + (columns or [
+                column for column in data.files if column != TIME_COLUMN])})
+        part[LOCATION_COLUMNS[source]] = location
+        return part
+
+    def read(self, source, start_date, end_date, days=None, locations=None, columns=None):
+        location_column = LOCATION_COLUMNS[source]
+        partitions = self.get_partitions(source, start_date, end_date, days, locations)
+        frames = [self.read_partition(source, location, path, columns) for location, path in partitions]
+        profiler.record(partitions_read=len(partitions), bytes_read=sum(os.path.getsize(path) for _, path in partitions))
+        if not frames:
+            return pd.DataFrame(columns=[TIME_COLUMN, location_column] + list(columns or []))
+
+        records = pd.concat(frames, ignore_index=True)
+        # Rows of the end date are kept whole, the range is limited to the exact timestamps otherwise
+        times = records[TIME_COLUMN]
+        selected = (times >= pd.Timestamp(start_date)) & (times < pd.Timestamp(end_date).normalize() + pd.Timedelta(
+            days=1))
+        return records[selected].sort_values([location_column, TIME_COLUMN]).reset_index(drop=True)
+
+
+def write_synthetic_dataset(directory, start_date, end_date, num_streets=20, num_loops=20, seed=0):
+    # Synthetic jams and loop counts around Lisbon, with the geojson files the spatial index reads
+    rng = np.random.default_rng(seed)
+    store = EventStore(os.path.join(directory, 'events'))
+    times = pd.date_range(start_date, pd.Timestamp(end_date) + pd.Timedelta(days=1), freq='5min')[:-1]
+    hours = times.hour + times.minute / 60
+    peaks = np.exp(-(hours - 8.5) ** 2 / 2) + np.exp(-(hours - 18) ** 2 / 3)
+    peaks = np.where(times.dayofweek < 5, peaks, 0.4 * peaks)
+
+    streets, loops = [], []
+    for i in range(num_streets):
+        lon, lat = -9.2 + rng.random() * 0.1, 38.7 + rng.random() * 0.06
+        coordinates = [[lon, lat], [lon + 0.004, lat + 0.002], [lon + 0.008, lat + 0.001]]
+        name = 'Rua {}'.format(i)
+        streets.append({'type': 'Feature', 'properties': {'street_name': name},
+                        'geometry': {'type': 'LineString', 'coordinates': coordinates}})
+        jams = rng.random(len(times)) < 0.02 + 0.3 * peaks
+        store.write('waze', pd.DataFrame({
+            TIME_COLUMN: times[jams], 'street_name': name,
+            'speed': rng.uniform(1, 10, jams.sum()).round(3),
+            'delay': rng.exponential(120, jams.sum()).round(1),
+            'length': rng.exponential(400, jams.sum()).round(1),
+            'path.street_coord': json.dumps(coordinates)}))
+
+    for i in range(num_loops):
+        lon, lat = -9.2 + rng.random() * 0.1, 38.7 + rng.random() * 0.06
+        loop = 'espira{}'.format(i)
+        loops.append({'type': 'Feature', 'properties': {'espira': loop},
+                      'geometry': {'type': 'Point', 'coordinates': [lon, lat]}})
+        store.write('espiras', pd.DataFrame({
+            TIME_COLUMN: times, 'espira': loop,
+            'count': rng.poisson(rng.uniform(10, 60) * (0.1 + peaks)).astype(float)}))
+
+    for name, features in [('streets.geojson', streets), ('espiras.geojson', loops)]:
+        with open(os.path.join(directory, name), 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': features}, f)
+    return store
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic event store to try the app without the data sources')
+    parser.add_argument('directory')
+    parser.add_argument('--start', default='2018-10-17')
+    parser.add_argument('--end', default='2019-01-01')
+    parser.add_argument('--streets', type=int, default=20)
+    parser.add_argument('--loops', type=int, default=20)
+    args = parser.parse_args()
+
+    write_synthetic_dataset(args.directory, args.start, args.end, args.streets, args.loops)
+    directory = os.path.abspath(args.directory)
+    print('ROADPM_EVENTS_PATH={}/events/ ROADPM_STREETS_GEOJSON={}/streets.geojson '
+          'ROADPM_LOOPS_GEOJSON={}/espiras.geojson'.format(directory, directory, directory))
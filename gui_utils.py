@@ -199,3 +199,36 @@ def get_calendar_days(calendario):
             dias.update(calendar[entry])
     if len(dias) == 7: return "all"
     return list(dias)
+
+
+def get_job_components(prefix="", interval=1000):
+    return [dcc.Input(id=prefix + 'job_id', value='', style={'display': 'none'}),
+            dcc.Interval(id=prefix + 'job_interval', interval=interval, disabled=True),
+            html.Div(id=prefix + 'job_status', style={'margin': 5, 'color': 'gray', 'font-size': '14px'})]
+
+
+def get_job_status_label(status):
+    if status['error']:
+        return html.Span('Erro: {}'.format(status['error']), style={'color': colors['red']})
+    if status['done']:
+        return ''
+    return html.Span('A executar: {} ({:.0f}s)...'.format(status['stage'], status['elapsed']))
+
+
+def get_profile_panel(stages):
+    header = ['Etapa', 'Tempo (s)', 'RSS início (MB)', 'Pico RSS (MB)', 'RSS fim (MB)', 'Pico RSS JVM (MB)',
+              'Tamanhos']
+    rows = []
+    for stage in stages:
+        sizes = ', '.join('{}: {}'.format(key, value) for key, value in stage.items() if
+                          key not in ('stage', 'wall_time', 'rss_start_mb', 'peak_rss_mb', 'rss_end_mb',
+                                      'jvm_peak_rss_mb'))
+        # Stages that ran no JVM have no JVM peak, None when the memory could not be read
+        jvm_rss = stage.get('jvm_peak_rss_mb', '-')
+        memory = [stage['rss_start_mb'], stage.get('peak_rss_mb'), stage['rss_end_mb'], jvm_rss]
+        rows.append(html.Tr([html.Td(value) for value in [stage['stage'], '{:.3f}'.format(stage['wall_time'])] + [
+            'não medido' if rss is None else rss for rss in memory] + [sizes]]))
+    total = sum(stage['wall_time'] for stage in stages)
+    return html.Details([html.Summary('Perfil de execução: {:.2f}s'.format(total)),
+                         html.Table([html.Tr([html.Th(column) for column in header])] + rows,
+                                    style={'font-size': '13px'})])
@@ -0,0 +1,159 @@
+'''
+@info columnar on-disk cache of uploaded CSV files, a file is only parsed once per path, size and mtime
+@author Francisco Neves
+@version 1.0
+'''
+
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+import profiler
+
+INGEST_PATH = str(os.path.abspath(os.path.dirname(__file__))) + '/data/ingest/'
+MAX_ENTRIES = int(os.environ.get('ROADPM_INGEST_MAX_ENTRIES', 16))
+METADATA_FILE = 'metadata.json'
+
+lock = threading.Lock()
+
+
+def get_key(csv_file):
+    stat = os.stat(csv_file)
+    key = '{}:{}:{}'.format(os.path.abspath(csv_file), stat.st_size, stat.st_mtime_ns)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def get_tz_metadata(tz):
+    # Named zones are kept by name, fixed offsets (e.g. parsed from '+01:00' suffixes) in seconds
+    name = getattr(tz, 'zone', None) or getattr(tz, 'key', None)
+    if name:
+        return {'tz': name}
+    return {'utc_offset': pd.Timestamp(0, tz=tz).utcoffset().total_seconds()}
+
+
+def get_tz(metadata):
+    if 'tz' in metadata:
+        return metadata['tz']
+    return datetime.timezone(datetime.timedelta(seconds=metadata['utc_offset']))
+
+
+def save_values(directory, name, values):
+    # Memory mapping needs fixed width dtypes. Datetimes are kept as int64 UTC timestamps with their unit and time
+    # zone in the metadata, text with a mask of its missing cells
+    path = os.path.join(directory, name + '.npy')
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        dates = pd.DatetimeIndex(values)
+        metadata = {'kind': 'datetime'}
+        if dates.tz is not None:
+            metadata.update(get_tz_metadata(dates.tz))
+            dates = dates.tz_convert(None)
+        metadata['unit'] = np.datetime_data(dates.dtype)[0]
+        np.save(path, dates.to_numpy().view(np.int64))
+        return metadata
+
+    values = np.asarray(values)
+    if values.dtype != object:
+        np.save(path, values)
+        return {}
+    missing = pd.isna(values)
+    np.save(path, np.where(missing, '', values).astype(str))
+    if not missing.any():
+        return {'kind': 'text'}
+    np.save(os.path.join(directory, name + '_missing.npy'), missing)
+    return {'kind': 'text', 'missing': True}
+
+
+def load_values(entry, name, metadata):
+    values = np.load(os.path.join(entry, name + '.npy'), mmap_mode='r')
+    kind = metadata.get('kind')
+    if kind == 'datetime':
+        dates = pd.DatetimeIndex(np.asarray(values).view('datetime64[{}]'.format(metadata['unit'])))
+        if 'tz' in metadata or 'utc_offset' in metadata:
+            dates = dates.tz_localize('UTC').tz_convert(get_tz(metadata))
+        return dates
+    if kind == 'text':
+        values = np.asarray(values).astype(object)
+        if metadata.get('missing'):
+            values[np.load(os.path.join(entry, name + '_missing.npy'))] = np.nan
+    return values
+
+
+def convert(csv_file, directory):
+    data = pd.read_csv(csv_file, parse_dates=True, index_col=[0])
+    os.makedirs(directory, exist_ok=True)
+    entry = os.path.join(directory, get_key(csv_file))
+    tmp = tempfile.mkdtemp(dir=directory, suffix='.tmp')
+    try:
+        values = {'index': save_values(tmp, 'index', data.index)}
+        for i, column in enumerate(data.columns):
+            values['column_{}'.format(i)] = save_values(tmp, 'column_{}'.format(i), data[column])
+        with open(os.path.join(tmp, METADATA_FILE), 'w') as f:
+            json.dump({'columns': list(data.columns), 'index_name': data.index.name, 'source': csv_file,
+                       'values': values}, f)
+
+        # Readers only ever see complete entries, the directory is renamed into place
+        os.rename(tmp, entry)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        # Another process (e.g. the web process converting an upload) renamed the same entry first
+        if os.path.exists(os.path.join(entry, METADATA_FILE)):
+            return entry
+        raise
+    return entry
+
+
+def evict(directory, max_entries=MAX_ENTRIES):
+    entries = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_dir() and os.path.exists(os.path.join(entry.path, METADATA_FILE)):
+                entries.append((entry.stat().st_mtime, entry.path))
+    for _, path in sorted(entries)[:max(0, len(entries) - max_entries)]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def get_entry(csv_file, directory=INGEST_PATH):
+    entry = os.path.join(directory, get_key(csv_file))
+    if os.path.exists(os.path.join(entry, METADATA_FILE)):
+        # Entries are evicted least recently used first
+        os.utime(entry)
+        return entry
+
+    with lock:
+        if not os.path.exists(os.path.join(entry, METADATA_FILE)):
+            entry = convert(csv_file, directory)
+            profiler.record(csv_parsed=1, bytes_read=os.path.getsize(csv_file))
+            evict(directory)
+    return entry
+
+
+def get_metadata(entry):
+    with open(os.path.join(entry, METADATA_FILE)) as f:
+        return json.load(f)
+
+
+def get_columns(csv_file, directory=INGEST_PATH):
+    return get_metadata(get_entry(csv_file, directory))['columns']
+
+
+def read_csv(csv_file, columns=None, directory=INGEST_PATH):
+    # Same frame as pd.read_csv(csv_file, parse_dates=True, index_col=[0]), restricted to the given columns
+    entry = get_entry(csv_file, directory)
+    metadata = get_metadata(entry)
+    positions = {column: i for i, column in enumerate(metadata['columns'])}
+    columns = metadata['columns'] if columns is None else columns
+
+    values = metadata.get('values', {})
+    index = pd.Index(load_values(entry, 'index', values.get('index', {})), name=metadata['index_name'],
+                     copy=True)
+    names = {column: 'column_{}'.format(positions[column]) for column in columns}
+    data = {column: load_values(entry, name, values.get(name, {})) for column, name in names.items()}
+    # Only the requested columns are read, copied out of the memory maps so the files can be evicted
+    return pd.DataFrame(data, index=index, columns=columns, copy=True)
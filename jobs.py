@@ -0,0 +1,189 @@
+'''
+@info background execution of long running queries in a local process pool, with their state shared on disk
+@author Francisco Neves
+@version 1.0
+'''
+
+import contextlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import scheduler
+
+MAX_WORKERS = int(os.environ.get('ROADPM_JOB_WORKERS', 2))
+# Stages and results are kept on disk, every web process can answer for a job whichever process submitted it
+JOBS_PATH = os.environ.get('ROADPM_JOBS_PATH', str(os.path.abspath(os.path.dirname(__file__))) + '/data/jobs/')
+# Finished jobs whose results were never fetched are dropped after this many seconds
+JOB_TTL = 3600
+
+
+def get_path(directory, job_id, extension):
+    return os.path.join(directory, job_id + extension)
+
+
+def write_file(path, value, binary=False):
+    # Readers in other processes only ever see complete files
+    with tempfile.NamedTemporaryFile('wb' if binary else 'w', dir=os.path.dirname(path), suffix='.tmp',
+                                     delete=False) as f:
+        if binary:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            json.dump(value, f)
+    os.replace(f.name, path)
+
+
+def remove(*paths):
+    for path in paths:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+class Progress:
+    def __init__(self, directory, job_id, submitted):
+        self.directory = directory
+        self.job_id = job_id
+        self.submitted = submitted
+
+    def write(self, stage, done=False, error=None):
+        write_file(get_path(self.directory, self.job_id, '.json'),
+                   {'stage': stage, 'submitted': self.submitted, 'done': done, 'error': error})
+
+    def __call__(self, stage):
+        self.write(stage)
+
+    def finish(self, error=None):
+        self.write('done' if error is None else 'failed', True, error)
+
+
+def run_job(directory, job_id, submitted, func, args, priority=scheduler.INTERACTIVE):
+    # The BicPAMS runs of the job are scheduled under its id and priority
+    scheduler.set_job(job_id, priority)
+    progress = Progress(directory, job_id, submitted)
+    try:
+        result = func(progress, *args)
+        write_file(get_path(directory, job_id, '.pkl'), result, binary=True)
+        progress.finish()
+    except Exception as e:
+        progress.finish(str(e))
+        raise
+    finally:
+        scheduler.set_job()
+
+
+class JobManager:
+    def __init__(self, max_workers=MAX_WORKERS, directory=JOBS_PATH):
+        self.max_workers = max_workers
+        self.directory = directory
+        self.executor = None
+        self.jobs = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+
+    def submit(self, func, *args, supersedes=None, priority=scheduler.INTERACTIVE):
+        # A job superseding a previous one keeps its session, the previous jobs of the session are cancelled.
+        # supersedes comes from the page, ids that JobManager did not make are ignored
+        session = scheduler.get_session(supersedes)
+        job_id = '{}-{}'.format(session or uuid.uuid4().hex, uuid.uuid4().hex)
+        if session:
+            scheduler.get_scheduler().supersede(job_id)
+        submitted = time.time()
+        Progress(self.directory, job_id, submitted)('queued')
+        with self.lock:
+            self.start()
+            self.collect()
+            for previous_id, (future, previous_submitted) in self.jobs.items():
+                if session and scheduler.get_session(previous_id) == session and future.cancel():
+                    Progress(self.directory, previous_id, previous_submitted).finish('Job was cancelled')
+            try:
+                future = self.executor.submit(run_job, self.directory, job_id, submitted, func, args, priority)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed by the OS), start a fresh pool
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                future = self.executor.submit(run_job, self.directory, job_id, submitted, func, args, priority)
+            self.jobs[job_id] = (future, submitted)
+        return job_id
+
+    def read_state(self, job_id):
+        if not scheduler.is_job_id(job_id):
+            return None
+        try:
+            with open(get_path(self.directory, job_id, '.json')) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def status(self, job_id):
+        state = self.read_state(job_id)
+        if state is None:
+            return {'stage': 'unknown', 'done': True, 'error': 'Job not found', 'elapsed': 0}
+
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if not state['done'] and job is not None and job[0].done():
+            # Stopped before it could write its state, its process died or it was cancelled before starting
+            error = 'Job was cancelled' if job[0].cancelled() else job[0].exception()
+            if error is not None:
+                state.update(stage='failed', done=True, error=str(error))
+        return {'stage': state['stage'], 'done': state['done'], 'error': state['error'],
+                'elapsed': time.time() - state['submitted']}
+
+    def result(self, job_id):
+        # None once the result was fetched, e.g. by a concurrent poll of the same page
+        with self.lock:
+            self.jobs.pop(job_id, None)
+        if not scheduler.is_job_id(job_id):
+            return None
+        path = get_path(self.directory, job_id, '.pkl')
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        remove(path, get_path(self.directory, job_id, '.json'))
+        return result
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.pop(job_id, None)
+        state = self.read_state(job_id)
+        if state is None:
+            return False
+        # A job already running, in the pool of this or any other web process, is stopped at its BicPAMS run
+        if not state['done'] and (job is None or not job[0].cancel()):
+            scheduler.get_scheduler().cancel(job_id)
+        remove(get_path(self.directory, job_id, '.pkl'), get_path(self.directory, job_id, '.json'))
+        return True
+
+    def collect(self):
+        now = time.time()
+        for job_id, (future, submitted) in list(self.jobs.items()):
+            if future.done() and now - submitted > JOB_TTL:
+                del self.jobs[job_id]
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                with contextlib.suppress(FileNotFoundError):
+                    if now - entry.stat().st_mtime > JOB_TTL:
+                        os.remove(entry.path)
+
+
+job_manager = None
+job_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    global job_manager
+    with job_manager_lock:
+        if job_manager is None:
+            job_manager = JobManager()
+    return job_manager
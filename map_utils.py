@@ -4,16 +4,58 @@
 @version 1.0
 '''
 
-import folium
+import hashlib
+import json
+import os
+import tempfile
+
 import dash_html_components as html
 
+MAPS_PATH = str(os.path.abspath(os.path.dirname(__file__))) + '/data/maps/'
+# Bump when the rendering changes without the map config changing, e.g. the Draw plugin template
+MAP_CACHE_VERSION = 1
+LISBON_MAP = {'location': [38.74, -9.14], 'zoom_start': 12, 'tiles': 'cartodbpositron'}
+
 
 def get_lisbon_map():
-    return folium.Map(location=[38.74, -9.14], zoom_start=12, tiles="cartodbpositron")
+    # folium is only needed when the map is not in the cache yet
+    import folium
 
+    return folium.Map(**LISBON_MAP)
 
-def embed_map(fmap, prefix='', height='700'):
-    map_url = prefix + "temp_map.html"
-    fmap.save(map_url)
-    return html.Div(html.Iframe(id=prefix + 'map', srcDoc=open(map_url, 'r').read(), width='100%', height=height),
+
+def render_map(fmap):
+    # Rendered in memory, nothing is written to the working directory
+    return fmap.get_root().render()
+
+
+def get_map_key(config):
+    # importlib.metadata needs Python 3.8, the environment is set up with 3.7
+    import folium
+
+    key = json.dumps([MAP_CACHE_VERSION, folium.__version__, config], sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def get_map_html(config, build, directory=MAPS_PATH):
+    # The map is built and rendered once per config, every worker then reads the same file
+    path = os.path.join(directory, get_map_key(config) + '.html')
+    if os.path.exists(path):
+        with open(path) as f:
+            return f.read()
+
+    map_html = render_map(build())
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as f:
+        f.write(map_html)
+    os.replace(f.name, path)
+    return map_html
+
+
+def embed_map_html(map_html, prefix='', height='700'):
+    return html.Div(html.Iframe(id=prefix + 'map', srcDoc=map_html, width='100%', height=height),
                     style={'margin-top': '20px'})
+
+
+def embed_map(fmap, prefix='', height='700'):
+    return embed_map_html(render_map(fmap), prefix, height)
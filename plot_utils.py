@@ -6,7 +6,6 @@
 
 import numpy as np
 import plotly.subplots as splt
-import plotly.figure_factory as plt
 import plotly.graph_objs as go
 
 ''' ================================= '''
@@ -93,6 +92,9 @@ def get_null_plot(message=None):
 
 
 def get_correlogram(series):
+    # figure_factory is slow to import and only needed here
+    import plotly.figure_factory as plt
+
     x = []
     for col in series.columns: x.append(col)
     z = series.corr()
@@ -0,0 +1,154 @@
+'''
+@info lightweight per-stage profiling of biclustering runs: wall time, memory and data sizes
+@author Francisco Neves
+@version 1.0
+'''
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+# Seconds between two samples of the memory of a process, the job itself or a BicPAMS JVM
+SAMPLE_INTERVAL = 0.1
+
+logger = logging.getLogger('roadpm.profiler')
+
+active_profiler = None
+active_profiler_lock = threading.Lock()
+
+
+def get_rss_mb(pid='self'):
+    # Current resident memory, ru_maxrss would carry the peaks of earlier jobs of a reused pool process.
+    # Read from /proc, memory is not reported where it does not exist
+    try:
+        with open('/proc/{}/statm'.format(pid)) as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(pages * PAGE_SIZE / 1024 ** 2, 1)
+
+
+class RssSampler:
+    # Peak resident memory of a process, sampled from a thread until stopped
+    def __init__(self, pid):
+        self.pid = pid
+        self.peak = get_rss_mb(pid)
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def update(self):
+        rss = get_rss_mb(self.pid)
+        if rss is not None:
+            self.peak = max(self.peak or 0, rss)
+
+    def sample(self):
+        while not self.done.wait(SAMPLE_INTERVAL):
+            self.update()
+
+    def stop(self):
+        self.done.set()
+        self.thread.join()
+        self.update()
+        return self.peak
+
+
+class Profiler:
+    def __init__(self, progress=None):
+        self.progress = progress
+        self.run_id = uuid.uuid4().hex[:8]
+        self.stages = []
+        self.current = None
+        self.lock = threading.Lock()
+        set_active_profiler(self)
+
+    def __call__(self, stage):
+        # Every progress update ends the running stage and starts the next one
+        with self.lock:
+            self.end_stage()
+            # Spikes in the middle of a stage (parsing, plotting) only show in its sampled peak
+            self.current = {'stage': stage, 'start': time.perf_counter(), 'rss_start_mb': get_rss_mb(),
+                            'sampler': RssSampler(os.getpid()), 'sizes': {}}
+        if self.progress:
+            self.progress(stage)
+
+    def record(self, **sizes):
+        # Sizes add up, stages running in parallel threads (partitions, sweeps) report their own share
+        with self.lock:
+            if self.current is None:
+                return
+            for key, value in sizes.items():
+                self.current['sizes'][key] = self.current['sizes'].get(key, 0) + value
+
+    def record_peak(self, **sizes):
+        # Peaks keep the highest value reported, None when it could not be measured
+        with self.lock:
+            if self.current is None:
+                return
+            for key, value in sizes.items():
+                previous = self.current['sizes'].get(key)
+                self.current['sizes'][key] = value if previous is None else max(previous, value or 0)
+
+    def end_stage(self):
+        if self.current is None:
+            return
+        stage = {'stage': self.current['stage'],
+                 'wall_time': round(time.perf_counter() - self.current['start'], 4),
+                 'rss_start_mb': self.current['rss_start_mb'], 'peak_rss_mb': self.current['sampler'].stop(),
+                 'rss_end_mb': get_rss_mb()}
+        stage.update(self.current['sizes'])
+        self.stages.append(stage)
+        self.current = None
+        logger.info(json.dumps(dict(stage, event='stage', run=self.run_id)))
+
+    def finish(self):
+        with self.lock:
+            self.end_stage()
+        set_active_profiler(None, self)
+        return self.stages
+
+    def get_total_time(self):
+        return sum(stage['wall_time'] for stage in self.stages)
+
+
+def get_profiler(progress=None):
+    return progress if isinstance(progress, Profiler) else Profiler(progress)
+
+
+def set_active_profiler(profiler, previous=None):
+    global active_profiler
+    with active_profiler_lock:
+        if previous is None or active_profiler is previous:
+            active_profiler = profiler
+
+
+def record(**sizes):
+    # Called from deep inside the pipeline, does nothing when no run is being profiled
+    profiler = active_profiler
+    if profiler is not None:
+        profiler.record(**sizes)
+
+
+def record_peak(**sizes):
+    profiler = active_profiler
+    if profiler is not None:
+        profiler.record_peak(**sizes)
+
+
+@contextlib.contextmanager
+def sample_rss(pid):
+    # Peak memory of a BicPAMS JVM while it runs a job, pooled JVMs are never waited for and so are missing from the
+    # resource usage of children
+    if active_profiler is None:
+        yield
+        return
+    sampler = RssSampler(pid)
+    try:
+        yield
+    finally:
+        record_peak(jvm_peak_rss_mb=sampler.stop())
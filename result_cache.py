@@ -0,0 +1,101 @@
+'''
+@info persistent cache of BicPAMS results keyed by transaction matrix and parameters
+@author Francisco Neves
+@version 1.0
+'''
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+CACHE_EXTENSION = '.bics'
+
+
+def get_key(data, parameters):
+    hasher = hashlib.sha256()
+    hasher.update(repr(list(data.index)).encode('utf-8'))
+    hasher.update(repr(list(data.columns)).encode('utf-8'))
+    hasher.update(np.ascontiguousarray(data.to_numpy(dtype=float)).data)
+    hasher.update(repr(sorted(parameters.items())).encode('utf-8'))
+    return hasher.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory, max_size=1024 ** 3, max_age=7 * 24 * 3600):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key + CACHE_EXTENSION)
+
+    def count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        # The entry is returned open, another process evicting it meanwhile does not take it from the reader
+        path = self.get_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+                raise FileNotFoundError(path)
+            entry = open(path, 'r')
+            # Entries are evicted least recently used first
+            os.utime(entry.fileno())
+        except FileNotFoundError:
+            self.count(False)
+            return None
+        self.count(True)
+        return entry
+
+    def put(self, key, file_path):
+        # Readers only ever see complete entries, the copy is renamed into place
+        with open(file_path, 'rb') as source:
+            with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as target:
+                shutil.copyfileobj(source, target)
+        os.replace(target.name, self.get_path(key))
+        self.evict()
+        return self.get_path(key)
+
+    def get_entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(CACHE_EXTENSION):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(entries)
+
+    def evict(self):
+        now = time.time()
+        entries = self.get_entries()
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, path in entries:
+            if now - mtime <= self.max_age and size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+    def stats(self):
+        entries = self.get_entries()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(entries),
+                'size': sum(entry[1] for entry in entries)}
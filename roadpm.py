@@ -7,20 +7,30 @@
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
+import dash_table
+import functools
+import logging
+import os
 import pandas as pd
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State, MATCH
 from pathlib import Path
-import json
-import statistics
+import uuid
 
 from app import app
+from session_store import get_session_store, is_token
+from bicluster_index import build_index, parse_filter, SORT_COLUMNS
+from jobs import get_job_manager
+from profiler import get_profiler
+from workspaces import Workspace
 import map_utils
 import gui_utils
+import scheduler
+import alignment
 import series_waze
 import series_espiras
 from roadpm_utils import Biclustering, get_pvalue_vs_area_figure, parameters_to_iluapp_layout, bicpams_parameters, \
-    get_biclustering_vis, get_waze_events
-from folium_draw import Draw
+    get_biclustering_vis, get_heatmap_figure, get_waze_events, parse_parameter_grid, get_parameter_sets, \
+    get_sweep_summary, get_parallelism, save_heatmaps, load_heatmap
 
 DOWNLOADS_PATH = str(Path(__file__).parent.parent.parent.parent) + '/data/temp/'
 
@@ -31,29 +41,35 @@ def get_multidrop_options(label_format, lst):
     } for el in lst]
 
 
-def get_graph(fig, title=None):
+def get_graph(fig, title=None, graph_id=None):
     children = []
 
     if title is not None:
         children.append(html.Div([html.H3(title, style={'marginBottom': 0})], style={'textAlign': "center"}))
 
-    children.append(dcc.Graph(figure=fig))
+    children.append(dcc.Graph(figure=fig) if graph_id is None else dcc.Graph(id=graph_id, figure=fig))
 
     return html.Div(children)
 
 
+DRAW_OPTIONS = {'page_prefix': 'padroes_rodovia',
+                'position': 'topleft',
+                'draw_options': {'polyline': True, 'marker': True, 'circlemarker': False, 'circle': False,
+                                 'polygon': True, 'rectangle': False},
+                'edit_options': {'poly': {'allowIntersection': False}}}
+
+
 def get_map():
+    from folium_draw import Draw
+
     lisbon_map = map_utils.get_lisbon_map()
-    Draw(page_prefix='padroes_rodovia',
-         position='topleft',
-         draw_options={'polyline': True, 'marker': True, 'circlemarker': False, 'circle': False, 'polygon': True,
-                       'rectangle': False},
-         edit_options={'poly': {'allowIntersection': False}}).add_to(lisbon_map)
+    Draw(**DRAW_OPTIONS).add_to(lisbon_map)
     return lisbon_map
 
 
-def embed_map(folium_map, prefix):
-    return map_utils.embed_map(folium_map, prefix, height='370')
+def embed_map(prefix):
+    map_html = map_utils.get_map_html({'map': map_utils.LISBON_MAP, 'draw': DRAW_OPTIONS}, get_map)
+    return map_utils.embed_map_html(map_html, prefix, height='370')
 
 
 def get_all_method_params():
@@ -86,22 +102,34 @@ charts = [
 ]
 
 default_biclusters_options = ['no_biclusters_available_yet']
-bics_plot_types = ['real_chart', 'discrete_chart', 'real_heatmap', 'discrete_heatmap']
+expired_biclusters_message = 'Os biclusters expiraram, execute novamente a query...'
+expired_series_message = 'As séries expiraram, execute novamente a query...'
+bics_plot_types = ['real_chart', 'discrete_chart', 'real_chart_bands', 'discrete_chart_bands', 'real_heatmap',
+                   'discrete_heatmap']
 method_parameters = {
     'biclustering_main': parameters_to_iluapp_layout(bicpams_parameters['main']) + [
         ('biclusters_plot', bics_plot_types,
          gui_utils.Button.radio),
         ('biclusters', default_biclusters_options, gui_utils.Button.multidrop),
-        ('biclusters_cache', '', gui_utils.Button.input_hidden)
+        ('biclusters_filter', '', gui_utils.Button.input),
+        ('biclusters_sort', SORT_COLUMNS, gui_utils.Button.unidrop),
+        ('biclusters_cache', '', gui_utils.Button.input_hidden),
+        ('parameter_sweep', '', gui_utils.Button.input),
+        ('partition_by', ['none', 'attribute', 'month', 'weekday_class'], gui_utils.Button.multidrop),
+        ('parallelism', '2', gui_utils.Button.input)
     ],
     'biclustering_optional': parameters_to_iluapp_layout(bicpams_parameters['optional'])
 }
 
-layout = gui_utils.get_layout(pagetitle, [('parameters', 27, parameters),
-                                          ('selection_map', 27, [('lisbon_map', embed_map(get_map(), prefix),
-                                                                  gui_utils.Button.html)]),
-                                          ('method_parameters', 27, get_all_method_params(), 'empty_box'),
-                                          ], charts, prefix=prefix)
+
+@functools.lru_cache(maxsize=None)
+def layout():
+    # Built on the first request rather than at import, pages importing this module never build the map
+    return gui_utils.get_layout(pagetitle, [('parameters', 27, parameters),
+                                            ('selection_map', 27, [('lisbon_map', embed_map(prefix),
+                                                                    gui_utils.Button.html)]),
+                                            ('method_parameters', 27, get_all_method_params(), 'empty_box'),
+                                            ], charts, gui_utils.get_job_components(prefix), prefix=prefix)
 
 
 def get_state_field(field: str, accessor: str = 'value', prefix: str = '', type=None):
@@ -118,57 +146,115 @@ def get_state_field(field: str, accessor: str = 'value', prefix: str = '', type=
     return value
 
 
-def biclustering_handler(speed_time_series, dataset, prefix=prefix):
+def get_state_params(prefix=prefix):
     state_params = dash.callback_context.states
     # remove prefix and .value from
     params = {}
     for key in state_params:
         params[key.replace(prefix, '').replace('.value', '')] = state_params[key]
+    return params
 
-    method = Biclustering(speed_time_series, params, dataset)
 
-    method_vis_figs = method.get_visualization()
-    bics = method.discover_patterns()
+def no_progress(stage):
+    pass
+
+
+def sweep_handler(method, params, prefix=prefix, progress=no_progress):
+    grid = parse_parameter_grid(params['parameter_sweep'])
+    parameter_sets = get_parameter_sets(params, grid)
+    results = method.sweep(parameter_sets, get_parallelism(params), progress)
+
+    progress('rendering')
+    summary = get_sweep_summary(parameter_sets, results, grid)
+    table = dash_table.DataTable(columns=[{'name': column, 'id': column} for column in summary[0]], data=summary,
+                                 sort_action='native', style_cell={'font-size': '13px'})
+    return [html.Div(id=prefix + 'biclusters_container', style={'width': '40%'}),
+            html.P(children='Parameter sweep: {} configurations'.format(len(parameter_sets))),
+            gui_utils.get_profile_panel(progress.finish()),
+            table], get_bicluster_index([])
+
 
+def get_bicluster_index(bics):
+    # Matrices are written next to the index in the session store, the index is stored under the same token
+    token = uuid.uuid4().hex
+    return build_index(bics, get_session_store().get_file_path(token, '.npz'), token)
+
+
+def get_heatmaps_path(token):
+    # Heatmaps of a run are stored next to its bicluster index and evicted with it
+    return get_session_store().get_file_path(token, '.heatmaps.npz')
+
+
+def get_bicluster_options(index, filter_text, sort):
+    if index is None or len(index) == 0:
+        return get_multidrop_options('{}', default_biclusters_options)
+    try:
+        positions = index.sort(index.filter(**parse_filter(filter_text)), sort)
+    except ValueError as e:
+        return [{'value': default_biclusters_options[0], 'label': str(e), 'disabled': True}]
+    return [{'value': str(position + 1), 'label': 'Bicluster {}'.format(position + 1)} for position in positions]
+
+
+def get_bicluster_plots(index, sel_bics, plot_type):
+    figs = []
+    for bic_i in sel_bics or []:
+        if bic_i == 'no_biclusters_available_yet':
+            break
+        bic = index.get(int(bic_i) - 1)
+        # The matrices of the run expired
+        if bic is None:
+            return None
+        fig = get_biclustering_vis(bic, plot_type)
+        figs.append(get_graph(fig, 'Bicluster {} - pvalue {:.4g}'.format(bic_i, bic.pvalue)))
+    return figs
+
+
+def biclustering_handler(speed_time_series, dataset, params, prefix=prefix, progress=no_progress, workspace=None):
+    progress = get_profiler(progress)
+    with Biclustering(speed_time_series, params, dataset, workspace) as method:
+        if params.get('parameter_sweep', '').strip():
+            return sweep_handler(method, params, prefix, progress)
+
+        bics = method.discover_patterns(progress)
+
+    progress('rendering')
+    method_vis_figs = method.get_visualization()
     stat_vis = get_pvalue_vs_area_figure(bics)
+    progress.record(figures=len(speed_time_series.columns) + 1)
+    stages = progress.finish()
 
-    num_bics = len(bics)
-    p_value_high = sum(float(x.get('pvalue')) > 0.01 for x in bics)
-    p_value_interval = sum(0.1 >= float(x.get('pvalue')) >= 1e-3 for x in bics)
-    p_value_low = sum(float(x.get('pvalue')) < 1e-3 for x in bics)
-    num_rows_mean = statistics.mean([len(x['matrix']) for x in bics])
-    num_rows_stdev = statistics.stdev([len(x['matrix']) for x in bics])
-    num_cols_mean = statistics.mean([len(x['cols']) for x in bics])
-    num_cols_stdev = statistics.stdev([len(x['cols']) for x in bics])
+    index = get_bicluster_index(bics)
+    summary = index.get_summary()
+    save_heatmaps([heatmap for _, _, heatmap in method_vis_figs], get_heatmaps_path(index.token))
 
     return [html.Div(id=prefix + 'biclusters_container', style={'width': '40%'}),
-            html.P(children='Num bics: {}'.format(num_bics)),
-            html.P(children='p-value > 0.01: {}'.format(p_value_high)),
-            html.P(children='p-value [1e-3, 0.1]: {}'.format(p_value_interval)),
-            html.P(children='p-value < 1e-3: {}'.format(p_value_low)),
+            html.P(children='Num bics: {}'.format(summary['num_bics'])),
+            gui_utils.get_profile_panel(stages),
+            html.P(children='p-value > 0.01: {}'.format(summary['p_value_high'])),
+            html.P(children='p-value [1e-3, 0.1]: {}'.format(summary['p_value_interval'])),
+            html.P(children='p-value < 1e-3: {}'.format(summary['p_value_low'])),
             html.P(children='Num rows mean: {}, standard deviation: {}'.format(
-                num_rows_mean, num_rows_stdev)),
+                summary['num_rows_mean'], summary['num_rows_stdev'])),
             html.P(children='Num columns mean: {}, standard deviation: {}'.format(
-                num_cols_mean, num_cols_stdev))
+                summary['num_cols_mean'], summary['num_cols_stdev']))
             ] + [
                get_graph(stat_vis, 'Statistical Significance vs Area')] + [
-               get_graph(fig, 'Heatmap - {}'.format(attribute.capitalize())) for
-               fig, attribute in
-               method_vis_figs], bics
+               get_graph(fig, 'Heatmap - {}'.format(attribute.capitalize()),
+                         {'type': 'heatmap', 'index': '{}-{}'.format(index.token, position)}) for
+               position, (fig, attribute, _) in
+               enumerate(method_vis_figs)], index
 
 
-def get_dataset_time_series(dataset, start_date, end_date, days, granularity):
-    geojson = get_state_field('geo_json', prefix=prefix, type=dict)
-    geojson = geojson['geometry'] if geojson else None
-
-    all_series = []
+def get_dataset_time_series(dataset, start_date, end_date, days, granularity, geojson):
+    all_series = {}
     time_series = None
     locations = []
     if not geojson:
         return False, 'Selecione um ponto no mapa para obter eventos...'
 
     if dataset == 'waze' or dataset == 'integrative':
-        events_per_street, events_locations = get_waze_events(start_date, end_date, geojson, days)
+        events_per_street, events_locations = get_waze_events(start_date, end_date, geojson, days,
+                                                                granularity)
         events_locations = events_locations.rename(columns={'street_name': 'place_id'})
         events_locations = events_locations.rename(columns={'path.street_coord': 'location'})
         events_locations['dataset'] = 'waze'
@@ -177,40 +263,28 @@ def get_dataset_time_series(dataset, start_date, end_date, days, granularity):
 
         # Get time series
         time_series, name = series_waze.get_event_series(events_per_street, granularity, geojson)
-        all_series.append(time_series)
+        all_series['waze'] = time_series
         locations.append(events_locations)
 
     if dataset == 'espiras' or dataset == 'integrative':
         time_series, events_locations = series_espiras.get_spatial_series_per_loop(start_date, end_date, granularity,
                                                                                    days, geojson)
+        if time_series.empty:
+            return False, 'Não foram encontradas contagens das espiras com os filtros selecionados...'
         events_locations = events_locations.rename(columns={'espira': 'place_id'})
         events_locations = events_locations.rename(columns={'coordinates': 'location'})
         events_locations['dataset'] = 'espiras'
         events_locations = events_locations.drop_duplicates('place_id')
 
         locations.append(events_locations)
-        all_series.append(time_series)
+        all_series['espiras'] = time_series
 
     if dataset != 'integrative':
         return True, (time_series, locations[0])
 
-    # Integrative
-    if len(all_series) > 1:
-        time_series = pd.merge(all_series[0], all_series[1], left_index=True, right_index=True)
-        locations = pd.concat(locations)
-    else:
-        time_series = all_series[0]
-        locations = locations[0]
-    for attr in time_series.columns:
-        if attr.startswith('speed'):
-            time_series[attr] = time_series[attr].fillna(time_series[attr].max())
-        elif attr.startswith('spatial_extension') or attr.startswith('delay'):
-            time_series[attr] = time_series[attr].fillna(0)
-        else:
-            # espiras
-            time_series[attr] = time_series[attr].fillna(0)
-
-    return True, (time_series, locations)
+    # Integrative, every source on the slots they all cover
+    time_series, _ = alignment.align(all_series)
+    return True, (time_series, pd.concat(locations))
 
 
 @app.callback(
@@ -220,18 +294,48 @@ def get_dataset_time_series(dataset, start_date, end_date, days, granularity):
 def show_bicluster_plot(sel_bics, bics, plot_type, *args):
     if bics == '':
         return ''
-    bics = json.loads(bics)
-
-    figs = []
-    for bic_i in sel_bics:
-        if bic_i == 'no_biclusters_available_yet':
-            break
-        bic = bics[int(bic_i) - 1]
-        fig = get_biclustering_vis(bic, plot_type)
-        figs.append(get_graph(fig, 'Bicluster {} - pvalue {:.4g}'.format(bic_i, float(bic['pvalue']))))
+    index = get_session_store().get(bics)
+    figs = None if index is None else get_bicluster_plots(index, sel_bics, plot_type)
+    if figs is None:
+        return html.Span(expired_biclusters_message)
     return figs
 
 
+@app.callback(
+    Output(prefix + 'biclusters', 'options'),
+    [Input(prefix + 'biclusters_cache', 'value'), Input(prefix + 'biclusters_filter', 'value'),
+     Input(prefix + 'biclusters_sort', 'value')])
+def filter_biclusters(bics, filter_text, sort, *args):
+    return get_bicluster_options(get_session_store().get(bics), filter_text, sort)
+
+
+@app.callback(
+    Output({'type': 'heatmap', 'index': MATCH}, 'figure'),
+    [Input({'type': 'heatmap', 'index': MATCH}, 'relayoutData')],
+    [State({'type': 'heatmap', 'index': MATCH}, 'id')])
+def zoom_heatmap(relayout_data, graph_id):
+    # Zooming into a range of aggregated rows redraws it at a finer resolution, double click goes back
+    if not relayout_data:
+        return dash.no_update
+    if relayout_data.get('yaxis.autorange'):
+        start, end = None, None
+    elif 'yaxis.range[0]' in relayout_data:
+        start, end = relayout_data['yaxis.range[0]'], relayout_data['yaxis.range[1]']
+    else:
+        return dash.no_update
+
+    token, _, position = graph_id['index'].partition('-')
+    if not is_token(token) or not position.isdigit():
+        return dash.no_update
+    heatmap = load_heatmap(get_heatmaps_path(token), int(position))
+    if heatmap is None:
+        return dash.no_update
+    fig = get_heatmap_figure(heatmap, start, end)
+    if 'xaxis.range[0]' in relayout_data:
+        fig.update_xaxes(range=[relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']])
+    return fig
+
+
 @app.callback(
     Output(prefix + 'method_parameters', 'children'),
     [Input(prefix + 'method', 'value')])
@@ -251,27 +355,48 @@ def change_method(abordagem, *args):
     return res
 
 
+def discovery_job(progress, dataset, start_date, end_date, days, granularity, geojson, time_series_orig, attributes,
+                  start_hour, end_hour, params):
+    progress = get_profiler(progress)
+    loaded = time_series_orig is None
+    if loaded:
+        progress('loading')
+        params_ok, res = get_dataset_time_series(dataset, start_date, end_date, days, granularity, geojson)
+        if not params_ok:
+            progress.finish()
+            return False, res
+        time_series_orig, locations = res
+        progress.record(rows=time_series_orig.shape[0], columns=time_series_orig.shape[1])
+
+    # Select only the columns of selected attributes
+    if attributes:
+        time_series = time_series_orig[attributes]
+    else:
+        time_series = time_series_orig
+
+    time_series = time_series.between_time(start_hour, end_hour)
+    filename = 'dataset_{}{}-{}{}-{}.csv'.format(start_date, start_hour, end_date, end_hour, dataset)
+    with Workspace() as workspace:
+        # Written in the job's workspace and moved into place, concurrent jobs never see a partial snapshot
+        time_series_orig.between_time(start_hour, end_hour).to_csv(workspace.get_path(filename))
+        workspace.publish(filename, os.path.join(DOWNLOADS_PATH, filename))
+
+        res, index = biclustering_handler(time_series, dataset, params, progress=progress, workspace=workspace)
+    return True, (res, index, time_series_orig if loaded else None)
+
+
 @app.callback(
-    [Output(prefix + 'charts', 'children'),
-     Output(prefix + 'biclusters', 'options'),
-     Output(prefix + 'attributes', 'options'),
-     Output(prefix + 'biclusters_cache', 'value'),
-     Output(prefix + 'series_cache', 'value')],
+    Output(prefix + 'job_id', 'value'),
     [Input(prefix + 'button', 'n_clicks'), Input(prefix + 'attributes', 'value')],
     gui_utils.get_states(
         parameters + get_all_method_params(), False,
-        prefix))
+        prefix) + [State(prefix + 'job_id', 'value')])
 def run_discovery(n_clicks, attributes, *args):
-    attributes_opts = []
     if not n_clicks:
-        return [[], default_biclusters_options, attributes_opts, '', '']
+        return ''
 
     trigger = dash.callback_context.triggered[0]
-    data_cached = False
-    if 'button' in trigger['prop_id']:
-        attributes = None
-    else:
-        data_cached = True
+    data_cached = 'button' not in trigger['prop_id']
 
     # Date range
     start_date = pd.to_datetime(get_state_field('date', 'start_date', prefix))
@@ -286,46 +411,73 @@ def run_discovery(n_clicks, attributes, *args):
 
     dataset = get_state_field('dataset', prefix=prefix, type=str)
 
-    if not data_cached:
-        params_ok, res = get_dataset_time_series(dataset, start_date, end_date, days, granularity)
-
-        if not params_ok:
-            res = html.Span(res)
-            return [[res], default_biclusters_options, attributes_opts, '', '']
-
-        time_series, locations = res
-        time_series_orig = time_series
-    else:
-        # Read stuff from cached fields
-        time_series_orig = pd.read_json(get_state_field('series_cache', prefix=prefix, type=str), orient='split')
+    geojson = get_state_field('geo_json', prefix=prefix, type=dict)
+    geojson = geojson['geometry'] if geojson else None
 
-        # Select only the columns of selected attributes
-        if len(attributes) != 0:
-            time_series = time_series_orig[attributes]
-        else:
-            time_series = time_series_orig
+    # Read the series kept server-side, the token may have expired
+    series_token = get_state_field('series_cache', prefix=prefix, type=str)
+    time_series_orig = get_session_store().get(series_token) if data_cached else None
 
     start_hour = get_state_field('start_hour', prefix=prefix, type=str)
     end_hour = get_state_field('end_hour', prefix=prefix, type=str)
 
-    time_series = time_series.between_time(start_hour, end_hour)
-    filename = 'dataset_{}{}-{}{}-{}'.format(start_date, start_hour, end_date, end_hour, dataset)
-    file_path = '{}/{}'.format(DOWNLOADS_PATH, filename)
-    time_series_orig.between_time(start_hour, end_hour).to_csv('{}.csv'.format(file_path))
+    # A new query cancels the previous job of the page, sweeps wait behind interactive runs
+    params = get_state_params()
+    previous_job = params.pop('job_id')
+    priority = scheduler.BATCH if params.get('parameter_sweep', '').strip() else scheduler.INTERACTIVE
+    return get_job_manager().submit(discovery_job, dataset, start_date, end_date, days, granularity, geojson,
+                                    time_series_orig, attributes if data_cached else None, start_hour, end_hour,
+                                    params, supersedes=previous_job, priority=priority)
 
-    res, bics = biclustering_handler(time_series, dataset)
-    bic_options = get_multidrop_options('Bicluster {}', range(1, len(bics) + 1))
-    bics_cache = json.dumps(bics)
 
-    time_series_attrs = list(time_series_orig.columns)
-    time_series_attrs = get_multidrop_options('{}', time_series_attrs)
+@app.callback(
+    [Output(prefix + 'charts', 'children'),
+     Output(prefix + 'attributes', 'options'),
+     Output(prefix + 'biclusters_cache', 'value'),
+     Output(prefix + 'series_cache', 'value'),
+     Output(prefix + 'job_status', 'children'),
+     Output(prefix + 'job_interval', 'disabled')],
+    [Input(prefix + 'job_interval', 'n_intervals'), Input(prefix + 'job_id', 'value')],
+    [State(prefix + 'series_cache', 'value')])
+def show_discovery(n_intervals, job_id, series_token, *args):
+    if not job_id:
+        return [[], [], '', '', '', True]
+
+    status = get_job_manager().status(job_id)
+    if not status['done']:
+        return [dash.no_update] * 4 + [gui_utils.get_job_status_label(status), False]
+    if status['error']:
+        get_job_manager().cancel(job_id)
+        return [dash.no_update] * 4 + [gui_utils.get_job_status_label(status), True]
+
+    result = get_job_manager().result(job_id)
+    if result is None:
+        # Fetched by a concurrent poll, which updates the page
+        return [dash.no_update] * 5 + [True]
+    params_ok, res = result
+    if not params_ok:
+        return [[html.Span(res)], [], '', '', '', True]
+
+    res, index, time_series_orig = res
+    store = get_session_store()
+    if time_series_orig is None:
+        # The job reused the series of the page, they may have expired while it ran
+        time_series_orig = store.get(series_token)
+        if time_series_orig is None:
+            return [[html.Span(expired_series_message)], [], '', '', '', True]
+    else:
+        series_token = store.put(time_series_orig)
 
-    attributes_opts += time_series_attrs
+    # The series of the same result must outlive the room made for its index
+    bics_cache = store.put(index, index.token, keep=[series_token])
+
+    time_series_attrs = list(time_series_orig.columns)
+    attributes_opts = get_multidrop_options('{}', time_series_attrs)
 
-    return [res, bic_options, attributes_opts, bics_cache,
-            time_series_orig.to_json(orient='split')]
+    return [res, attributes_opts, bics_cache, series_token, '', True]
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     app.layout = layout
     app.run_server(debug=False, port=8051)
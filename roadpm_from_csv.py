@@ -5,17 +5,22 @@
 """
 
 import dash
-import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
+import functools
+import logging
 import os
-import pandas as pd
-import json
 
 from app import app
+from session_store import get_session_store
+from jobs import get_job_manager
+from profiler import get_profiler
 import gui_utils
-from roadpm import method_parameters, biclustering_handler, get_multidrop_options
-from roadpm_utils import get_biclustering_vis
+import ingestion
+import scheduler
+import upload
+from roadpm import method_parameters, biclustering_handler, get_multidrop_options, get_state_params, \
+    get_bicluster_options, get_bicluster_plots, expired_biclusters_message
 
 
 def get_all_method_params():
@@ -33,7 +38,8 @@ prefix = 'padroes_rodovia_from_file'
 
 parameters = [
     ('nan', '10', gui_utils.Button.input_hidden),
-    ('csv_file_upload', '', gui_utils.Button.upload),
+    ('csv_file_upload', upload.get_upload_component(prefix + 'csv_file_upload', prefix + 'csv_file_path'),
+     gui_utils.Button.html),
     ('csv_file_path', '', gui_utils.Button.input_hidden),
     ('method', 'biclustering', gui_utils.Button.input_hidden),
     ('dataset', ['waze', 'espiras', 'integrative'], gui_utils.Button.radio),
@@ -43,20 +49,14 @@ charts = [
     ('results_container', gui_utils.get_null_label(), gui_utils.Button.html, True)
 ]
 
-layout = gui_utils.get_layout(pagetitle, [('parameters', 27, parameters),
-                                          ('method_parameters', 27, get_all_method_params(), 'empty_box')], charts,
-                              prefix=prefix)
+upload.register(app.server)
 
 
-def get_graph(fig, title=None):
-    children = []
-
-    if title is not None:
-        children.append(html.Div([html.H3(title, style={'marginBottom': 0})], style={'textAlign': "center"}))
-
-    children.append(dcc.Graph(figure=fig))
-
-    return html.Div(children)
+@functools.lru_cache(maxsize=None)
+def layout():
+    return gui_utils.get_layout(pagetitle, [('parameters', 27, parameters),
+                                            ('method_parameters', 27, get_all_method_params(), 'empty_box')], charts,
+                                gui_utils.get_job_components(prefix), prefix=prefix)
 
 
 def get_state_field(field: str, accessor: str = 'value', prefix: str = '', type=None):
@@ -80,18 +80,21 @@ def get_state_field(field: str, accessor: str = 'value', prefix: str = '', type=
 def show_bicluster_plot(sel_bics, bics, plot_type, *args):
     if bics == '':
         return ''
-    bics = json.loads(bics)
-
-    figs = []
-    for bic_i in sel_bics:
-        if bic_i == 'no_biclusters_available_yet':
-            break
-        bic = bics[int(bic_i) - 1]
-        fig = get_biclustering_vis(bic, plot_type)
-        figs.append(get_graph(fig, 'Bicluster {} - pvalue {:.4g}'.format(bic_i, float(bic['pvalue']))))
+    index = get_session_store().get(bics)
+    figs = None if index is None else get_bicluster_plots(index, sel_bics, plot_type)
+    if figs is None:
+        return html.Span(expired_biclusters_message)
     return figs
 
 
+@app.callback(
+    Output(prefix + 'biclusters', 'options'),
+    [Input(prefix + 'biclusters_cache', 'value'), Input(prefix + 'biclusters_filter', 'value'),
+     Input(prefix + 'biclusters_sort', 'value')])
+def filter_biclusters(bics, filter_text, sort, *args):
+    return get_bicluster_options(get_session_store().get(bics), filter_text, sort)
+
+
 @app.callback(
     Output(prefix + 'method_parameters', 'children'),
     [Input(prefix + 'method', 'value')])
@@ -111,54 +114,82 @@ def change_method(abordagem, *args):
     return res
 
 
-@app.callback([Output(prefix + 'csv_file_upload_output', 'children'), Output(prefix + 'csv_file_path', 'value')],
-              [Input(prefix + 'csv_file_upload', 'filename')])
+@app.callback(Output(prefix + 'csv_file_upload_output', 'children'),
+              [Input(prefix + 'csv_file_path', 'value')])
 def update_output(csv_file, *args):
+    # The path is set by assets/chunked_upload.js once the upload finishes
     if csv_file is None or len(csv_file) == 0:
-        return '', ''
-    return html.Span(children=csv_file), DOWNLOADS_PATH + csv_file
+        return ''
+    return html.Span(children=os.path.basename(csv_file))
+
+
+def csv_job(progress, csv_file, attributes, dataset, params):
+    progress = get_profiler(progress)
+    progress('loading')
+    # Parsed once per file version, later runs only read the selected columns
+    all_attributes = ingestion.get_columns(csv_file)
+    if len(attributes) > 1 or attributes[0] != '':
+        time_series = ingestion.read_csv(csv_file, attributes)
+    else:
+        time_series = ingestion.read_csv(csv_file)
+    progress.record(rows=time_series.shape[0], columns=time_series.shape[1])
+
+    res, index = biclustering_handler(time_series, dataset, params, prefix=prefix, progress=progress)
+    return res, index, all_attributes
 
 
 @app.callback(
-    [Output(prefix + 'results_container', 'children'),
-     Output(prefix + 'attributes', 'options'),
-     Output(prefix + 'biclusters', 'options'),
-     Output(prefix + 'biclusters_cache', 'value')
-     ],
+    Output(prefix + 'job_id', 'value'),
     [Input(prefix + 'button', 'n_clicks')],
     gui_utils.get_states(
         parameters + get_all_method_params(), False,
-        prefix))
+        prefix) + [State(prefix + 'job_id', 'value')])
 def run(n_clicks, *args):
     dataset = get_state_field('dataset', prefix=prefix, type=str)
 
     csv_file = get_state_field('csv_file_path', prefix=prefix, type=str)
     if csv_file == '':
-        return [], [], '', ''
-
-    state_params = dash.callback_context.states
-    # remove prefix and .value from
-    params = {}
-    for key in state_params:
-        params[key.replace(prefix, '').replace('.value', '')] = state_params[key]
-    time_series_orig = pd.read_csv(csv_file, parse_dates=True, index_col=[0])
+        return ''
+
     attributes = get_state_field('attributes', prefix=prefix, type=list)
+    params = get_state_params(prefix)
+    previous_job = params.pop('job_id')
+    priority = scheduler.BATCH if params.get('parameter_sweep', '').strip() else scheduler.INTERACTIVE
+    return get_job_manager().submit(csv_job, csv_file, attributes, dataset, params, supersedes=previous_job,
+                                    priority=priority)
 
-    if len(attributes) > 1 or attributes[0] != '':
-        time_series = time_series_orig[attributes]
-    else:
-        time_series = time_series_orig
 
-    res, bics = biclustering_handler(time_series, dataset, prefix=prefix)
-    bic_options = get_multidrop_options('Bicluster {}', range(1, len(bics) + 1))
-    bics_cache = json.dumps(bics)
+@app.callback(
+    [Output(prefix + 'results_container', 'children'),
+     Output(prefix + 'attributes', 'options'),
+     Output(prefix + 'biclusters_cache', 'value'),
+     Output(prefix + 'job_status', 'children'),
+     Output(prefix + 'job_interval', 'disabled')],
+    [Input(prefix + 'job_interval', 'n_intervals'), Input(prefix + 'job_id', 'value')])
+def show_results(n_intervals, job_id, *args):
+    if not job_id:
+        return [], [], '', '', True
+
+    status = get_job_manager().status(job_id)
+    if not status['done']:
+        return [dash.no_update] * 3 + [gui_utils.get_job_status_label(status), False]
+    if status['error']:
+        get_job_manager().cancel(job_id)
+        return [dash.no_update] * 3 + [gui_utils.get_job_status_label(status), True]
+
+    result = get_job_manager().result(job_id)
+    if result is None:
+        # Fetched by a concurrent poll, which updates the page
+        return [dash.no_update] * 4 + [True]
+    res, index, time_series_attrs = result
+    bics_cache = get_session_store().put(index, index.token)
 
-    time_series_attrs = list(time_series_orig.columns)
     time_series_attrs = get_multidrop_options('{}', time_series_attrs)
 
-    return res, time_series_attrs, bic_options, bics_cache
+    return res, time_series_attrs, bics_cache, '', True
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     app.layout = layout
     app.run_server(debug=False, port=8050)
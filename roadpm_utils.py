@@ -1,69 +1,249 @@
 import numpy as np
-import plotly.graph_objects as go
-import dash_html_components as html
 import subprocess
+import json
+import logging
 import re
-import hashlib
-import gui_utils
-from arff2pandas import a2p
+import itertools
+import shutil
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import arff_writer
+from bicluster import Bicluster
+import bicpams_worker
+import profiler
+import result_cache
+import scheduler
+import workspaces
 import pandas as pd
 import os
 
 DOWNLOADS_PATH = str(os.path.abspath(os.path.dirname(__file__))) + '/data/'
 JAR_DIRECTORY = str(os.path.dirname(__file__))
+CACHE_PATH = DOWNLOADS_PATH + 'cache/'
+CACHE_MAX_SIZE = int(os.environ.get('BICPAMS_CACHE_MAX_SIZE', 1024 ** 3))
+CACHE_MAX_AGE = int(os.environ.get('BICPAMS_CACHE_MAX_AGE', 7 * 24 * 3600))
+# Number of long-lived BicPAMS JVMs, 0 starts a new JVM for every run
+BICPAMS_WORKERS = int(os.environ.get('BICPAMS_WORKERS', 2))
+# Bicluster line charts draw at most this many rows, larger biclusters are decimated
+MAX_CHART_ROWS = 200
+# Heatmaps never send more rows than this to the browser, longer ranges are aggregated
+MAX_HEATMAP_ROWS = 400
+HEATMAP_PERIODS = [('D', 'Dia'), ('W', 'Semana'), ('M', 'Mês'), ('Y', 'Ano')]
 
+logger = logging.getLogger('roadpm.utils')
 
-def get_waze_events(start_date, end_date, geojson, days):
-    # implementation needs access to the data sources
-    pass
+
+def get_waze_events(start_date, end_date, geojson, days, granularity):
+    # Jams per slot on the streets within the selected geometry, aggregated from the rollups of the selected days
+    from shapely.geometry import mapping
+    import rollups
+    import spatial_index
+
+    streets = spatial_index.get_streets(geojson)
+    events = rollups.get_series('waze', start_date, end_date, days, streets, granularity)
+    found = list(dict.fromkeys(events['street_name']))
+    return events, pd.DataFrame({'street_name': found, 'path.street_coord': [
+        json.dumps(mapping(spatial_index.get_street_geometry(street))['coordinates']) for street in found]})
 
 
 def reshape_data(data):
     data = data.copy()
-    data['Day'] = data.apply(lambda x: x.name.strftime('%Y-%m-%d'), axis=1)
-    data['Hour'] = data.apply(lambda x: x.name.strftime('%H:%M'), axis=1)
+    data['Day'] = data.index.strftime('%Y-%m-%d')
+    data['Hour'] = data.index.strftime('%H:%M')
     return data
 
 
+def get_missing_value(series, attribute):
+    if attribute.startswith('speed'):
+        return series[attribute].max()
+    return 0
+
+
+def get_transaction_column(attribute, hour, dataset):
+    if dataset != 'integrative' and attribute.startswith(('speed', 'spatial_extension', 'delay')):
+        return '{}_{}'.format(attribute, hour)
+    return '{}_{}'.format(hour, attribute)
+
+
+def get_day_slot_grid(index):
+    day_codes, days = pd.factorize(index.normalize(), sort=True)
+    slot_codes, slots = pd.factorize(index.hour * 60 + index.minute, sort=True)
+    return day_codes, days, slot_codes, slots
+
+
+def get_slot_labels(slots):
+    return ['{:02d}:{:02d}'.format(slot // 60, slot % 60) for slot in slots]
+
+
+def build_transaction_matrix(series, dataset):
+    # Day x (attribute, time slot) matrix built in a single pass over the DatetimeIndex
+    index = series.index
+    day_codes, days, slot_codes, slots = get_day_slot_grid(index)
+
+    cells = day_codes.astype(np.int64) * len(slots) + slot_codes
+    if len(cells) and np.bincount(cells).max() > 1:
+        raise ValueError('Index contains duplicate entries, cannot reshape')
+
+    values = series.to_numpy(dtype=float, copy=True)
+    missing = np.array([get_missing_value(series, attr) for attr in series.columns], dtype=float)
+    values[values == missing] = np.nan
+
+    matrix = np.full((len(days), len(series.columns), len(slots)), np.nan)
+    matrix[day_codes, :, slot_codes] = values
+    matrix = matrix.reshape(len(days), -1)
+
+    hours = get_slot_labels(slots)
+    columns = np.array([get_transaction_column(attr, hour, dataset) for attr in series.columns for hour in hours])
+    order = np.argsort(columns, kind='stable')
+
+    return pd.DataFrame(matrix[:, order], index=pd.Index(days.strftime('%Y-%m-%d'), name='Day'),
+                        columns=columns[order].tolist())
+
+
+results_cache = None
+
+
+def get_results_cache():
+    global results_cache
+    if results_cache is None:
+        results_cache = result_cache.ResultCache(CACHE_PATH, CACHE_MAX_SIZE, CACHE_MAX_AGE)
+    return results_cache
+
+
 def get_bics_max_and_min(bics, matrix_type):
-    all_values = []
-    for bic in bics:
-        for k in bic[matrix_type]:
-            for i in k:
-                all_values.append(float(i))
-    return min(all_values) - 1, max(all_values) + 1
+    bounds = np.array([bic.bounds[matrix_type] for bic in bics])
+    return np.nanmin(bounds[:, 0]) - 1, np.nanmax(bounds[:, 1]) + 1
 
 
 def get_biclustering_vis(bic, type):
-    matrix = 'real_matrix' if type.startswith('real') else 'matrix'
+    import plotly.graph_objects as go
 
-    if type.endswith('chart'):
-        fig = go.Figure()
+    matrix = 'real_matrix' if type.startswith('real') else 'matrix'
 
-        for i, line in enumerate(bic[matrix]):
-            fig.add_trace(go.Scatter(x=bic['cols'], y=line, name='row {}'.format(i)))
+    values = bic.get_values(matrix)
 
-        fig.update_layout(showlegend=False)
+    if '_chart' in type:
+        fig = get_bicluster_chart(bic, values, type.endswith('bands'))
     else:
         heatmap = go.Heatmap(
-            z=bic[matrix],
-            x=bic['cols'],
-            y=list(range(len(matrix))),
+            z=values,
+            x=bic.cols,
+            y=list(range(bic.num_rows)),
             colorscale='OrRd')
         fig = go.Figure(data=heatmap)
 
     return fig
 
 
+def get_chart_rows(num_rows, max_rows=MAX_CHART_ROWS):
+    if num_rows <= max_rows:
+        return np.arange(num_rows)
+    return np.unique(np.linspace(0, num_rows - 1, max_rows).round().astype(int))
+
+
+def get_bicluster_chart(bic, values, bands=False, max_rows=MAX_CHART_ROWS):
+    import plotly.graph_objects as go
+
+    # All rows go in a single WebGL trace, a NaN after each row breaks the line between rows
+    rows = get_chart_rows(len(values), max_rows)
+    num_cols = values.shape[1]
+    x = np.tile(np.append(np.arange(num_cols, dtype=float), np.nan), len(rows))
+    y = np.hstack([values[rows], np.full((len(rows), 1), np.nan)]).ravel()
+    customdata = np.repeat(rows, num_cols + 1)
+
+    fig = go.Figure()
+    fig.add_trace(go.Scattergl(x=x, y=y, customdata=customdata, mode='lines', connectgaps=False,
+                               line={'width': 1}, opacity=0.6 if bands else 1,
+                               hovertemplate='row %{customdata}: %{y}<extra></extra>'))
+
+    if bands and len(values):
+        # Bands use every row, also the ones left out of the lines
+        lower, median, upper = np.nanquantile(values, [0.25, 0.5, 0.75], axis=0)
+        positions = np.arange(num_cols)
+        fig.add_trace(go.Scatter(x=positions, y=lower, mode='lines', line={'width': 0}, name='q25'))
+        fig.add_trace(go.Scatter(x=positions, y=upper, mode='lines', line={'width': 0}, name='q75', fill='tonexty',
+                                 fillcolor='rgba(237, 85, 59, 0.3)'))
+        fig.add_trace(go.Scatter(x=positions, y=median, mode='lines', line={'color': '#ed553b', 'width': 3},
+                                 name='median'))
+
+    if len(rows) < len(values):
+        fig.update_layout(title='{} of {} rows shown'.format(len(rows), len(values)))
+    fig.update_layout(showlegend=False)
+    fig.update_xaxes(tickmode='array', tickvals=list(range(num_cols)), ticktext=bic.cols)
+    return fig
+
+
+def aggregate_heatmap_rows(values, days, max_rows=MAX_HEATMAP_ROWS):
+    # Days are averaged into weeks or months until the rows fit, keeping the figure payload bounded
+    dates = pd.DatetimeIndex(days)
+    for period, label in HEATMAP_PERIODS:
+        if period == 'D':
+            groups = dates
+        else:
+            groups = dates.to_period(period).start_time
+        if groups.nunique() <= max_rows or period == HEATMAP_PERIODS[-1][0]:
+            break
+    if period == 'D':
+        return values, list(days), label
+    means = pd.DataFrame(values).groupby(groups).mean()
+    return means.to_numpy(dtype=np.float32), list(means.index.strftime('%Y-%m-%d')), label
+
+
+def get_heatmap_figure(heatmap, start=None, end=None, max_rows=MAX_HEATMAP_ROWS):
+    import plotly.graph_objects as go
+
+    days = np.asarray(heatmap['days'])
+    selected = np.ones(len(days), dtype=bool)
+    if start is not None:
+        selected &= days >= pd.Timestamp(start).strftime('%Y-%m-%d')
+    if end is not None:
+        selected &= days <= pd.Timestamp(end).strftime('%Y-%m-%d')
+    if not selected.any():
+        selected[:] = True
+
+    values, rows, label = aggregate_heatmap_rows(heatmap['values'][selected], days[selected], max_rows)
+    heatmap = go.Heatmap(
+        z=values,
+        x=heatmap['hours'],
+        y=rows,
+        colorscale='OrRd',
+        reversescale=heatmap['reverse_scale'])
+    fig = go.Figure(data=heatmap)
+    fig.update_layout(yaxis_title=label)
+    return fig
+
+
+def save_heatmaps(heatmaps, path):
+    # Every heatmap of a run in one file, the attributes share the days and hours of the series
+    arrays = {'values_{}'.format(i): heatmap['values'] for i, heatmap in enumerate(heatmaps)}
+    if heatmaps:
+        arrays.update(days=np.array(heatmaps[0]['days'], dtype=str), hours=np.array(heatmaps[0]['hours'], dtype=str),
+                      reverse_scale=np.array([heatmap['reverse_scale'] for heatmap in heatmaps]))
+    np.savez(path, **arrays)
+
+
+def load_heatmap(path, position):
+    # Only the values of the zoomed heatmap are read, None once the run's files were evicted
+    try:
+        with np.load(path) as data:
+            return {'values': data['values_{}'.format(position)], 'days': data['days'],
+                    'hours': data['hours'].tolist(), 'reverse_scale': bool(data['reverse_scale'][position])}
+    except (FileNotFoundError, KeyError):
+        return None
+
+
 def get_pvalue_vs_area_figure(bics):
+    import plotly.graph_objects as go
+
     fig = go.Figure()
-    fig.add_trace(go.Scatter(x=[bic['area'] for bic in bics], y=[bic['pvalue'] for bic in bics], mode='markers'))
+    fig.add_trace(go.Scatter(x=[bic.area for bic in bics], y=[bic.pvalue for bic in bics], mode='markers'))
     fig.update_layout(yaxis_type='log', xaxis_title='area', yaxis_title='pvalue')
     return fig
 
 
 class Biclustering:
-    def __init__(self, series, parameters, dataset):
+    def __init__(self, series, parameters, dataset, workspace=None):
         self.series = series
         self.transactions = reshape_data(series)
         self.reverse_scale_map = {
@@ -75,86 +255,286 @@ class Biclustering:
         self.parameters = parameters
         self.dataset = dataset
         self.context_cutpoints = None
+        self.transaction_matrix = None
+        self.results_cache = get_results_cache()
+        # Exported matrices and BicPAMS outputs are kept apart from other runs, a workspace is made when none is given
+        self.workspace = workspace
+        self.owns_workspace = workspace is None
+        self.workspace_lock = threading.Lock()
+
+    def get_workspace(self):
+        # Sweeps and partitions ask for it from several threads
+        with self.workspace_lock:
+            if self.workspace is None:
+                self.workspace = workspaces.Workspace()
+        return self.workspace
+
+    def close(self):
+        if self.owns_workspace and self.workspace is not None:
+            self.workspace.close()
+            self.workspace = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def get_visualization(self):
+        import dash_html_components as html
+
         if self.transactions.empty:
             return html.Span('Não foram encontrados congestionamentos para executar o modelo...')
 
+        day_codes, days, slot_codes, slots = get_day_slot_grid(self.series.index)
+        days, hours = list(days.strftime('%Y-%m-%d')), get_slot_labels(slots)
+
         figs = []
         for attr in self.series.columns:
-            values = self.transactions[attr]
-            days = self.transactions['Day']
-            hours = self.transactions['Hour']
-
             reverse_scale = False
             if self.dataset == 'waze' or self.dataset == 'integrative':
                 for key in self.reverse_scale_map:
                     if attr.startswith(key):
                         reverse_scale = self.reverse_scale_map[key]
 
-            heatmap = go.Heatmap(
-                z=values,
-                x=hours,
-                y=days,
-                colorscale='OrRd',
-                reversescale=reverse_scale)
-            fig = go.Figure(data=heatmap)
-            figs.append((fig, attr))
+            # Dense day x hour matrix pivoted once on the server, plotly does not have to grid long-format data
+            values = np.full((len(days), len(hours)), np.nan, dtype=np.float32)
+            values[day_codes, slot_codes] = self.series[attr].to_numpy(dtype=float)
+            heatmap = {'values': values, 'days': days, 'hours': hours, 'reverse_scale': reverse_scale}
+            figs.append((get_heatmap_figure(heatmap), attr, heatmap))
 
         return figs
 
-    def discover_patterns(self):
-        arff_file = self.export_transactions()
-        bics = self.bicpams_wrapper.run(arff_file, self.parameters)
+    def get_transaction_matrix(self):
+        if self.transaction_matrix is None:
+            self.transaction_matrix = build_transaction_matrix(self.series, self.dataset)
+        return self.transaction_matrix
+
+    def get_cache_key(self, parameters=None, data=None):
+        parameters = self.parameters if parameters is None else parameters
+        data = self.get_transaction_matrix() if data is None else data
+        return result_cache.get_key(data, self.bicpams_wrapper.get_parameters(parameters))
+
+    def discover_patterns(self, progress=None):
+        partition_by = [key for key in self.parameters.get('partition_by') or [] if key != 'none']
+        if partition_by:
+            return self.discover_partitioned_patterns(partition_by, get_parallelism(self.parameters), progress)
+        return self.run_parameters(self.parameters, progress=progress)
+
+    def run_parameters(self, parameters, arff_file=None, progress=None, data=None):
+        key = self.get_cache_key(parameters, data)
+        cached_file = self.results_cache.get(key)
+        if cached_file is not None:
+            if progress:
+                progress('parsing')
+            with cached_file:
+                bics = list(iter_bics(cached_file))
+            profiler.record(cache_hits=1, biclusters=len(bics))
+            return bics
+
+        input_file = '{}.arff'.format(self.get_file_path(key))
+        if arff_file is None:
+            if progress:
+                progress('export')
+            self.export_transactions(input_file, data=data)
+        else:
+            link_file(arff_file, input_file)
+
+        shape = (self.get_transaction_matrix() if data is None else data).shape
+        bics = self.bicpams_wrapper.run(input_file, parameters, progress, shape)
+        profiler.record(biclusters=len(bics))
+        self.results_cache.put(key, get_output_file(input_file))
         return bics
 
-    def replace_missing_values(self, data, attribute):
-        if attribute.startswith('speed'):
-            val_to_replace = self.series[attribute].max()
-        elif attribute.startswith('spatial_extension'):
-            val_to_replace = 0
-        elif attribute.startswith('delay'):
-            val_to_replace = 0
-        else:
-            val_to_replace = 0
+    def sweep(self, parameter_sets, max_workers=2, progress=None):
+        # The matrix is exported once and linked under a per-configuration name, as outputs follow input names
+        if progress:
+            progress('export')
+        arff_file = self.export_transactions(
+            '{}.arff'.format(self.get_file_path(result_cache.get_key(self.get_transaction_matrix(), {}))))
+
+        def run(parameters):
+            start = time.perf_counter()
+            bics = self.run_parameters(parameters, arff_file)
+            return bics, time.perf_counter() - start
 
-        return data.replace(val_to_replace, np.nan)
+        if progress:
+            progress('mining')
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(run, parameter_sets))
 
-    def get_file_path(self):
+    def get_file_path(self, key=None):
         min_date, max_date = self.transactions['Day'].iloc[0], self.transactions['Day'].iloc[
             len(self.transactions.index) - 1]
-        filename = 'biclustering_{}-{}-{}-{}'.format(min_date, max_date, self.dataset, hash_params(self.parameters))
-        file_path = '{}{}'.format(DOWNLOADS_PATH, filename)
-        return file_path
+        filename = 'biclustering_{}-{}-{}-{}'.format(min_date, max_date, self.dataset, key or self.get_cache_key())
+        return self.get_workspace().get_path(filename)
+
+    def get_partitions(self, partition_by):
+        data = self.get_transaction_matrix()
+
+        row_labels = np.full(len(data), '', dtype=object)
+        days = pd.to_datetime(data.index)
+        if 'month' in partition_by:
+            row_labels += np.asarray(days.strftime('%Y-%m'), dtype=object)
+        if 'weekday_class' in partition_by:
+            import gui_utils
+            weekdays = np.isin(days.dayofweek + 1, list(gui_utils.calendar['dias_uteis']))
+            row_labels += np.where(weekdays, 'dias_uteis', 'fim_de_semana')
+        row_groups = [np.flatnonzero(row_labels == label) for label in pd.unique(row_labels)]
+
+        column_groups = [np.arange(len(data.columns))]
+        if 'attribute' in partition_by:
+            column_labels = np.empty(len(data.columns), dtype=object)
+            for attr in self.series.columns:
+                family = next((key for key in self.reverse_scale_map if attr.startswith(key)), attr)
+                column = get_transaction_column(attr, '', self.dataset)
+                matches = data.columns.str.startswith(column) if column.endswith('_') else data.columns.str.endswith(
+                    column)
+                column_labels[matches] = family
+            column_groups = [np.flatnonzero(column_labels == label) for label in pd.unique(column_labels)]
+
+        return [(rows, columns) for rows in row_groups for columns in column_groups]
+
+    def discover_partitioned_patterns(self, partition_by, max_workers=2, progress=None):
+        data = self.get_transaction_matrix()
+        partitions = self.get_partitions(partition_by)
+
+        def run(partition):
+            rows, columns = partition
+            return self.run_parameters(self.parameters, data=data.iloc[rows, columns])
+
+        if progress:
+            progress('mining')
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(run, partitions))
+
+        if progress:
+            progress('parsing')
+        return merge_partitioned_bics([rows for rows, _ in partitions], results,
+                                      self.parameters.get('sorting_criteria'))
+
+    def export_transactions(self, arff_file=None, data=None):
+        data = self.get_transaction_matrix() if data is None else data
+        arff_file = arff_file or '{}.arff'.format(self.get_file_path())
+
+        arff_writer.write_arff(arff_file, data.columns, data.to_numpy())
+        profiler.record(rows=data.shape[0], columns=data.shape[1], bytes_written=os.path.getsize(arff_file))
+        return arff_file
 
-    def export_transactions(self):
-        data = None
-        for attr in self.series.columns:
-            new_columns = self.transactions.pivot('Day', 'Hour', attr)
-            new_columns = self.replace_missing_values(new_columns, attr)
-
-            if self.dataset != 'integrative':
-                if attr.startswith('speed') or attr.startswith('spatial_extension') or attr.startswith('delay'):
-                    new_columns = new_columns.add_prefix('{}_'.format(attr))
-                else:
-                    new_columns = new_columns.add_suffix('_{}'.format(attr))
-            else:
-                new_columns = new_columns.add_suffix('_{}'.format(attr))
-            if data is None:
-                data = new_columns
-            else:
-                data = pd.concat([data, new_columns], axis=1, sort=False)
-        file_path = self.get_file_path()
-        # Reorder columns
-        data = data.reindex(sorted(data.columns), axis=1)
-
-        for hour in data.columns:
-            data = data.rename(columns={hour: '{}@NUMERIC'.format(hour)})
-        arff_file = '{}.arff'.format(file_path)
-        with open(arff_file, 'w') as f:
-            a2p.dump(data, f)
 
-        return arff_file
+def get_pattern(bic):
+    # Most frequent discrete value of each column, in column name order
+    values = bic.get_values('matrix')[:, np.argsort(bic.cols)]
+    pattern = []
+    for column in values.T:
+        labels, counts = np.unique(column[~np.isnan(column)], return_counts=True)
+        pattern.append(float(labels[np.argmax(counts)]) if len(labels) else None)
+    return tuple(pattern)
+
+
+def combine_pvalues(pvalues):
+    # Fisher's method, chi-squared survival function with 2k degrees of freedom in closed form.
+    # Partitions have disjoint rows, so their tests are independent
+    half = -sum(np.log(max(pvalue, np.finfo(float).tiny)) for pvalue in pvalues)
+    term = total = 1.0
+    for i in range(1, len(pvalues)):
+        term *= half / i
+        total += term
+    return min(1.0, float(np.exp(-half) * total))
+
+
+def merge_bics(group, num_partitions):
+    cols = group[0][1].cols
+    rows, real_matrices, matrices = [], [], []
+    for bic_rows, bic in group:
+        order = [bic.cols.index(col) for col in cols]
+        rows.append(bic_rows)
+        real_matrices.append(bic.real_matrix[:, order])
+        matrices.append(bic.get_values('matrix')[:, order])
+    rows = np.concatenate(rows)
+    order = np.argsort(rows, kind='stable')
+    pvalue = min(1.0, combine_pvalues([bic.pvalue for _, bic in group]) * num_partitions)
+    return Bicluster(cols, rows[order], np.concatenate(real_matrices)[order], np.concatenate(matrices)[order], pvalue,
+                     len(rows) * len(cols))
+
+
+def merge_partitioned_bics(partition_rows, results, sorting_criteria=None):
+    # Rows are mapped back to days of the full matrix. Biclusters with the same columns and pattern in several
+    # partitions are one pattern cut by the partition boundaries: their rows are joined, p-values combined and
+    # Bonferroni corrected for the number of partitions, and areas recomputed on the merged rows
+    groups = {}
+    for rows, bics in zip(partition_rows, results):
+        # Within a partition the most significant of the biclusters sharing columns and pattern is kept
+        found = {}
+        for bic in bics:
+            # BicPAMS rows are 0-based positions in the partition's submatrix
+            if len(bic.rows) and (bic.rows.min() < 0 or bic.rows.max() >= len(rows)):
+                raise ValueError('Bicluster rows {} are out of the {} rows of its partition'.format(
+                    bic.rows.tolist(), len(rows)))
+            key = (tuple(sorted(bic.cols)), get_pattern(bic))
+            if key not in found or bic.pvalue < found[key][1].pvalue:
+                found[key] = (rows[bic.rows], bic)
+        for key, value in found.items():
+            groups.setdefault(key, []).append(value)
+
+    bics = [merge_bics(group, len(partition_rows)) for group in groups.values()]
+    if sorting_criteria == 'PValue':
+        bics.sort(key=lambda bic: bic.pvalue)
+    elif sorting_criteria == 'NumberOfRows':
+        bics.sort(key=lambda bic: -bic.num_rows)
+    else:
+        bics.sort(key=lambda bic: -bic.num_rows * bic.num_cols)
+    return bics
+
+
+def link_file(source, target):
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def parse_parameter_grid(text):
+    # e.g. 'coherency_strength=3,4,5; quality=60,70'
+    names = [param['name'] for key in bicpams_parameters for param in bicpams_parameters[key]]
+    grid = {}
+    for entry in text.split(';'):
+        if not entry.strip():
+            continue
+        name, _, values = entry.partition('=')
+        name = name.strip()
+        if name not in names:
+            raise ValueError('Unknown BicPAMS parameter: {}'.format(name))
+        grid[name] = [value.strip() for value in values.split(',') if value.strip()]
+        if not grid[name]:
+            raise ValueError('No values given for {}'.format(name))
+    return grid
+
+
+def get_parameter_sets(parameters, grid):
+    names = list(grid)
+    return [dict(parameters, **dict(zip(names, values))) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def get_sweep_summary(parameter_sets, results, grid):
+    summary = []
+    for parameters, (bics, wall_time) in zip(parameter_sets, results):
+        pvalues = np.array([bic.pvalue for bic in bics])
+        row = {name: parameters[name] for name in grid}
+        row.update({
+            'bics': len(bics),
+            'p-value < 1e-3': int(np.sum(pvalues < 1e-3)),
+            'p-value [1e-3, 0.1]': int(np.sum((pvalues >= 1e-3) & (pvalues <= 0.1))),
+            'p-value > 0.01': int(np.sum(pvalues > 0.01)),
+            'median p-value': '{:.3g}'.format(np.median(pvalues)) if len(bics) else '',
+            'mean rows': round(float(np.mean([bic.num_rows for bic in bics])), 2) if len(bics) else '',
+            'mean columns': round(float(np.mean([bic.num_cols for bic in bics])), 2) if len(bics) else '',
+            'time (s)': round(wall_time, 2)
+        })
+        summary.append(row)
+    return summary
 
 
 def parse_string_list(string):
@@ -166,8 +546,9 @@ def parse_string_list(string):
 
 
 def parse_matrix(matrix):
-    lines = matrix.split('\n')[:-3]
-    return [line.split('\t')[1:] for line in lines]
+    # One line per row, starting with the row name. The real matrix ends with one newline and the discrete matrix
+    # with three, the original parser dropped three lines of both and lost the last two rows of every real matrix
+    return [line.split('\t')[1:] for line in matrix.split('\n') if line.strip()]
 
 
 bicpams_parameters = {
@@ -233,6 +614,8 @@ bicpams_parameters = {
 
 
 def parameters_to_iluapp_layout(parameters):
+    import gui_utils
+
     res = []
     for param in parameters:
         name = param['name']
@@ -246,26 +629,94 @@ def parameters_to_iluapp_layout(parameters):
     return res
 
 
-def hash_params(params):
-    return hashlib.sha256(str(params).encode('utf-8')).hexdigest()
+def get_output_file(input_file):
+    return '{}.bics'.format(input_file.split('.arff')[0])
+
+
+BICS_HEADER = re.compile(
+    r'I=(\[.+\]) \(\d+,\d+\) Y=(\[.*\]) X=(\[[\d,]*\]) pvalue=([\d.E-]+) area=([\d.E-]+)$')
+BICS_VALUES = re.compile(r'[-\d:.\s]*')
+
+
+def get_values_block(body, start, max_spaces):
+    # Longest run of values starting at start with at most max_spaces consecutive whitespaces between them
+    values = BICS_VALUES.match(body, start).group()
+    if values[:1].isspace():
+        return ''
+    gap = re.search(r'\s{%d}' % (max_spaces + 1), values)
+    return values if gap is None else values[:gap.start() + max_spaces]
+
+
+def split_bic_matrices(body):
+    # Same boundaries as the original regex: real matrix, newline, discrete matrix
+    real_matrix = get_values_block(body, 0, 1)
+    if body[len(real_matrix):len(real_matrix) + 1] != '\n':
+        end = real_matrix.rfind('\n')
+        if end == -1:
+            return None
+        real_matrix = real_matrix[:end]
+    return real_matrix, get_values_block(body, len(real_matrix) + 1, 3)
+
+
+def to_array(matrix):
+    width = max((len(row) for row in matrix), default=0)
+    try:
+        return np.array(matrix, dtype=float).reshape(len(matrix), width)
+    except ValueError:
+        # Ragged rows and empty cells are kept as missing values
+        cells = [[value or 'nan' for value in row] + ['nan'] * (width - len(row)) for row in matrix]
+        return np.array(cells, dtype=float).reshape(len(matrix), width)
+
+
+def get_bic(header, body):
+    matrices = split_bic_matrices(body)
+    if matrices is None:
+        return None
+    _, cols, rows, pvalue, area = header.groups()
+    real_matrix, matrix = matrices
+    return Bicluster(parse_string_list(cols), [int(row) for row in parse_string_list(rows) if row],
+                     to_array(parse_matrix(real_matrix)), to_array(parse_matrix(matrix)), pvalue, area)
+
+
+def iter_bics(lines):
+    header, body, closed = None, [], False
+    for line in lines:
+        match = BICS_HEADER.search(line[:-1]) if 'I=' in line and line.endswith('\n') else None
+        if match:
+            if header is not None:
+                bic = get_bic(header, ''.join(body))
+                if bic is not None:
+                    yield bic
+            header, body, closed = match, [], False
+        elif header is not None and not closed:
+            # Nothing after a line with other characters can belong to the current bicluster
+            body.append(line)
+            closed = BICS_VALUES.fullmatch(line) is None
+    if header is not None:
+        bic = get_bic(header, ''.join(body))
+        if bic is not None:
+            yield bic
+
+
+def iter_bics_from_file(file_path):
+    with open(file_path, 'r') as f:
+        yield from iter_bics(f)
+
+
+def get_parallelism(parameters):
+    # Threads of a sweep or partitioned run. More than the BicPAMS runs allowed at once, or than the JVMs of the pool,
+    # would only wait, the pool keeps its size
+    try:
+        parallelism = int(parameters.get('parallelism') or 1)
+    except (TypeError, ValueError):
+        logger.warning('Invalid parallelism %r, running one configuration at a time', parameters.get('parallelism'))
+        parallelism = 1
+    limit = min(scheduler.MAX_CONCURRENT, BICPAMS_WORKERS) if BICPAMS_WORKERS > 0 else scheduler.MAX_CONCURRENT
+    return max(1, min(parallelism, limit))
 
 
 def parse_bics_from_file(file_path):
-    f = open(file_path, 'r')
-    contents = f.read()
-
-    bics = []
-
-    # Regex to process biclusters
-    matches = re.findall(
-        r'I=(\[.+\]) \(\d+,\d+\) Y=(\[.*\]) X=(\[[\d,]*\]) pvalue=([\d.E-]+) area=([\d.E-]+)\n(([-\d:.]+[\s]{0,1})*)\n(([-\d:.]+[\s]{0,3})*)',
-        contents)
-    for items, cols, x, pvalue, area, real_matrix, _, matrix, _ in matches:
-        cols = parse_string_list(cols)
-        real_matrix = parse_matrix(real_matrix)
-        matrix = parse_matrix(matrix)
-        bics.append({'cols': cols, 'real_matrix': real_matrix, 'matrix': matrix, 'pvalue': pvalue, 'area': area})
-    return bics
+    return list(iter_bics_from_file(file_path))
 
 
 class BicPamsPyWrapper:
@@ -275,17 +726,49 @@ class BicPamsPyWrapper:
             parameters += bicpams_parameters[key]
         self.parameters = parameters
 
-    def run(self, input_file, params):
-        args = ['java', '-cp', '"bicpams.jar:lib/*"', 'tests.others.BicFranciscoTests']
-        for param in self.parameters:
-            name = param['name']
-            value = params[name]
-            args += ['--{}'.format(name), '{}'.format(value)]
-        args += ['--file_path', input_file]
-
-        command = ' '.join(args)
-        print('Running {}'.format(command))
-        subprocess.call(command, cwd=JAR_DIRECTORY, shell=True)
-        output_file = '{}.bics'.format(input_file.split('.arff')[0])
+    def get_parameters(self, params):
+        return {param['name']: '{}'.format(params[param['name']]) for param in self.parameters}
 
+    def get_arguments(self, input_file, params):
+        args = []
+        for name, value in self.get_parameters(params).items():
+            args += ['--{}'.format(name), value]
+        args += ['--file_path', input_file]
+        return args
+
+    def run(self, input_file, params, progress=None, shape=None):
+        args = self.get_arguments(input_file, params)
+        heap = scheduler.get_heap_size(*shape) if shape else scheduler.MIN_HEAP
+        if progress:
+            progress('queued')
+
+        # Runs wait for a slot shared by every process, a cancelled or timed out run has its JVM killed
+        output_file = None
+        with scheduler.get_scheduler().acquire() as slot:
+            if progress:
+                progress('mining')
+            if BICPAMS_WORKERS > 0:
+                try:
+                    output_file = bicpams_worker.get_worker_pool(BICPAMS_WORKERS).run(args, heap=heap,
+                                                                                      watch=slot.watch)
+                except bicpams_worker.WorkerUnavailable as e:
+                    logger.warning('BicPAMS worker unavailable (%s), starting a new JVM', e)
+                except bicpams_worker.WorkerCrashed:
+                    slot.check()
+                    raise
+
+            if output_file is None:
+                command = ['java', '-Xmx{}m'.format(heap), '-cp', bicpams_worker.CLASSPATH,
+                           'tests.others.BicFranciscoTests'] + args
+                logger.info('Running %s', ' '.join(command))
+                process = subprocess.Popen(command, cwd=bicpams_worker.JAR_DIRECTORY)
+                slot.watch(process.kill)
+                with profiler.sample_rss(process.pid):
+                    process.wait()
+                slot.watch(None)
+                output_file = get_output_file(input_file)
+            slot.check()
+        if progress:
+            progress('parsing')
+        profiler.record(bytes_read=os.path.getsize(output_file), heap_mb=heap)
         return parse_bics_from_file(output_file)
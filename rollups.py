@@ -0,0 +1,113 @@
+'''
+@info pre-aggregated series per location at base granularities, other granularities are derived from them
+@author Francisco Neves
+@version 1.0
+'''
+
+import argparse
+import os
+
+import pandas as pd
+
+import profiler
+from event_store import EventStore, LOCATION_COLUMNS, TIME_COLUMN
+
+ROLLUPS_PATH = os.environ.get('ROADPM_ROLLUPS_PATH',
+                              str(os.path.abspath(os.path.dirname(__file__))) + '/data/rollups/')
+BASES = [5, 15, 60]
+# How the records of a location within the same slot are combined into each attribute
+ATTRIBUTES = {'waze': {'speed': 'mean', 'delay': 'sum', 'length': 'max'}, 'espiras': {'count': 'sum'}}
+
+
+def get_base(granularity):
+    # Largest base the granularity is a multiple of, None when it is not a multiple of any
+    bases = [base for base in BASES if granularity % base == 0]
+    return bases[-1] if bases else None
+
+
+def aggregate(records, source, minutes, rolled=False):
+    # Means are kept as sums and counts so that rollups can be aggregated again into coarser slots
+    location_column = LOCATION_COLUMNS[source]
+    aggregations = {}
+    for attribute, how in ATTRIBUTES[source].items():
+        if how == 'mean':
+            aggregations[attribute + '_sum'] = (attribute + '_sum' if rolled else attribute, 'sum')
+            aggregations[attribute + '_count'] = (attribute + '_count', 'sum') if rolled else (attribute, 'count')
+        else:
+            aggregations[attribute] = (attribute, how)
+    if records.empty:
+        return pd.DataFrame(columns=[location_column, TIME_COLUMN] + list(aggregations))
+
+    slots = records[TIME_COLUMN].dt.floor('{}min'.format(minutes)).rename(TIME_COLUMN)
+    return records.groupby([records[location_column], slots]).agg(**aggregations).reset_index()
+
+
+def finalize(records, source):
+    records = records.copy()
+    for attribute, how in ATTRIBUTES[source].items():
+        if how == 'mean':
+            records[attribute] = records.pop(attribute + '_sum') / records.pop(attribute + '_count')
+    return records
+
+
+def is_stale(path, mtime):
+    return not os.path.exists(path) or os.path.getmtime(path) < mtime
+
+
+class Rollups:
+    def __init__(self, directory=ROLLUPS_PATH, events=None):
+        self.events = EventStore() if events is None else events
+        # Rollups are stored just like the events, one store per base
+        self.stores = {base: EventStore(os.path.join(directory, '{}min'.format(base))) for base in BASES}
+
+    def update(self, source, start_date=None, end_date=None, days=None, locations=None):
+        # Only event partitions written after their rollups are aggregated again, new days are picked up as they come
+        if start_date is None:
+            event_days = self.events.get_days(source)
+            if not event_days:
+                return 0
+            start_date, end_date = event_days[0], event_days[-1]
+
+        stale = {}
+        for location, path in self.events.get_partitions(source, start_date, end_date, days, locations):
+            day, mtime = os.path.basename(os.path.dirname(path)), os.path.getmtime(path)
+            if any(is_stale(store.get_partition_path(source, day, location), mtime) for store in self.stores.values()):
+                stale.setdefault(day, []).append((location, path))
+
+        # Locations of the same day are aggregated together, pandas overhead would dominate per partition
+        for partitions in stale.values():
+            records = pd.concat([self.events.read_partition(source, location, path, list(ATTRIBUTES[source])) for
+                                 location, path in partitions], ignore_index=True)
+            rolled = aggregate(records, source, BASES[0])
+            for base, store in self.stores.items():
+                store.write(source, rolled if base == BASES[0] else aggregate(rolled, source, base, True))
+        updated = sum(len(partitions) for partitions in stale.values())
+        profiler.record(rollups_updated=updated)
+        return updated
+
+    def read(self, source, start_date, end_date, days=None, locations=None, granularity=60):
+        # One row per location and slot of the granularity, with the attributes of the source
+        base = get_base(granularity)
+        if base is None:
+            records = self.events.read(source, start_date, end_date, days, locations, list(ATTRIBUTES[source]))
+            return finalize(aggregate(records, source, granularity), source)
+
+        self.update(source, start_date, end_date, days, locations)
+        rolled = self.stores[base].read(source, start_date, end_date, days, locations)
+        if granularity != base or rolled.empty:
+            rolled = aggregate(rolled, source, granularity, True)
+        return finalize(rolled, source)
+
+
+def get_series(source, start_date, end_date, days, locations, granularity):
+    return Rollups().read(source, start_date, end_date, days, locations, granularity)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bring the rollups up to date with the event store')
+    parser.add_argument('--source', nargs='+', default=list(ATTRIBUTES))
+    args = parser.parse_args()
+
+    rollups = Rollups()
+    for source in args.source:
+        print('{}: {} partitions updated'.format(source, rollups.update(source)))
@@ -0,0 +1,262 @@
+'''
+@info bounds the BicPAMS runs of every process on the machine, with priorities, heap limits, cancellation and timeouts
+@author Francisco Neves
+@version 1.0
+'''
+
+import contextlib
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+import profiler
+
+try:
+    import fcntl
+except ImportError:
+    # Slots are file locks, BicPAMS runs can only be scheduled on POSIX systems. Markers and heap sizes still work
+    fcntl = None
+
+SCHEDULER_PATH = os.environ.get('ROADPM_SCHEDULER_PATH',
+                                str(os.path.abspath(os.path.dirname(__file__))) + '/data/scheduler/')
+# BicPAMS runs at once across all web and job processes sharing the directory
+MAX_CONCURRENT = int(os.environ.get('ROADPM_BICPAMS_CONCURRENCY', max(1, (os.cpu_count() or 2) // 2)))
+# Seconds a run may take before its JVM is killed
+TIMEOUT = int(os.environ.get('ROADPM_BICPAMS_TIMEOUT', 1800))
+# JVM heap in MB, grows with the size of the matrix
+MIN_HEAP = 256
+MAX_HEAP = int(os.environ.get('ROADPM_BICPAMS_MAX_HEAP', 4096))
+HEAP_BYTES_PER_CELL = 512
+INTERACTIVE, BATCH = 'interactive', 'batch'
+PRIORITIES = {INTERACTIVE: 0, BATCH: 1}
+POLL_INTERVAL = 0.1
+# Markers of cancelled jobs and sessions are kept this long
+MARKER_TTL = 24 * 3600
+COLLECT_INTERVAL = 60
+# Job ids come back from the pages, only ids made by jobs.JobManager are used in paths
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}-[0-9a-f]{32}$')
+
+
+class SchedulerError(Exception):
+    pass
+
+
+class JobCancelled(SchedulerError):
+    pass
+
+
+class JobTimeout(SchedulerError):
+    pass
+
+
+def get_heap_size(rows, columns):
+    # Power of two MB, so that the pooled JVMs are not restarted for every slightly larger matrix
+    needed = rows * columns * HEAP_BYTES_PER_CELL / 1024 ** 2
+    heap = MIN_HEAP
+    while heap < needed and heap < MAX_HEAP:
+        heap *= 2
+    return min(heap, MAX_HEAP)
+
+
+def is_job_id(job_id):
+    return isinstance(job_id, str) and JOB_ID_PATTERN.match(job_id) is not None
+
+
+def get_session(job_id):
+    # Job ids are <session>-<id>, a page resubmitting a query keeps the session of its previous job
+    return job_id.split('-')[0] if is_job_id(job_id) else None
+
+
+def try_lock(path, fd=None):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT) if fd is None else fd
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+# Job run by this process, set by jobs.run_job, runs outside of a job are batch
+current_job = {'job_id': None, 'priority': BATCH}
+
+
+def set_job(job_id=None, priority=BATCH):
+    current_job.update(job_id=job_id, priority=priority)
+
+
+class Slot:
+    def __init__(self, scheduler, fd, job_id, timeout):
+        self.scheduler = scheduler
+        self.fd = fd
+        self.job_id = job_id
+        self.deadline = time.time() + timeout
+        self.reason = None
+        self.kill = None
+        self.lock = threading.Lock()
+        self.released = threading.Event()
+        threading.Thread(target=self.watchdog, daemon=True).start()
+
+    def watchdog(self):
+        while not self.released.wait(POLL_INTERVAL * 5):
+            if self.scheduler.is_cancelled(self.job_id):
+                self.stop('cancelled')
+            elif time.time() > self.deadline:
+                self.stop('timeout')
+            if self.reason is not None:
+                return
+
+    def stop(self, reason):
+        with self.lock:
+            self.reason = reason
+            if self.kill is not None:
+                self.kill()
+
+    def watch(self, kill):
+        # kill stops the JVM running the job, None once the JVM is no longer running it
+        with self.lock:
+            self.kill = kill
+            if kill is not None and self.reason is not None:
+                kill()
+
+    def check(self):
+        if self.reason == 'cancelled':
+            raise JobCancelled('BicPAMS run was cancelled')
+        if self.reason == 'timeout':
+            raise JobTimeout('BicPAMS run took longer than {}s'.format(self.scheduler.timeout))
+
+    def release(self):
+        self.released.set()
+        os.close(self.fd)
+
+
+class Scheduler:
+    def __init__(self, directory=SCHEDULER_PATH, max_concurrent=MAX_CONCURRENT, timeout=TIMEOUT):
+        self.directory = directory
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.last_collect = 0
+        for name in ['queue', 'slots', 'cancelled', 'sessions']:
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    def get_path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    def write_marker(self, path, content):
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), suffix='.tmp', delete=False) as f:
+            f.write(content)
+        os.replace(f.name, path)
+
+    def cancel(self, job_id):
+        if not is_job_id(job_id):
+            raise ValueError('Invalid job id {!r}'.format(job_id))
+        self.write_marker(self.get_path('cancelled', job_id), '')
+
+    def supersede(self, job_id):
+        # Every other job of the session is cancelled, in whichever process it runs or waits
+        if not is_job_id(job_id):
+            raise ValueError('Invalid job id {!r}'.format(job_id))
+        self.write_marker(self.get_path('sessions', get_session(job_id)), job_id)
+
+    def is_cancelled(self, job_id):
+        if not is_job_id(job_id):
+            return False
+        if os.path.exists(self.get_path('cancelled', job_id)):
+            return True
+        try:
+            with open(self.get_path('sessions', get_session(job_id))) as f:
+                return f.read() != job_id
+        except OSError:
+            return False
+
+    def create_ticket(self, priority):
+        # Locked before being renamed into the queue, others never take a new ticket for an abandoned one
+        name = '{}-{:020d}-{}'.format(PRIORITIES[priority], time.time_ns(), uuid.uuid4().hex)
+        tmp = self.get_path('queue', name + '.tmp')
+        fd = try_lock(tmp)
+        os.replace(tmp, self.get_path('queue', name))
+        return name, fd
+
+    def get_waiting(self, own):
+        # Tickets in priority then arrival order, tickets no process holds any more are removed
+        waiting = []
+        for name in sorted(os.listdir(self.get_path('queue'))):
+            if name.endswith('.tmp'):
+                continue
+            if name != own:
+                path = self.get_path('queue', name)
+                try:
+                    fd = try_lock(path, os.open(path, os.O_RDWR))
+                except FileNotFoundError:
+                    continue
+                if fd is not None:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(path)
+                    os.close(fd)
+                    continue
+            waiting.append(name)
+        return waiting
+
+    def try_slot(self):
+        for i in range(self.max_concurrent):
+            fd = try_lock(self.get_path('slots', 'slot-{}.lock'.format(i)))
+            if fd is not None:
+                return fd
+        return None
+
+    def collect(self):
+        now = time.time()
+        if now - self.last_collect < COLLECT_INTERVAL:
+            return
+        self.last_collect = now
+        for kind in ['cancelled', 'sessions']:
+            for entry in os.scandir(self.get_path(kind)):
+                with contextlib.suppress(FileNotFoundError):
+                    if now - entry.stat().st_mtime > MARKER_TTL:
+                        os.remove(entry.path)
+
+    @contextlib.contextmanager
+    def acquire(self, job_id=None, priority=None):
+        # Waits for a free slot, first in line by priority then arrival
+        if fcntl is None:
+            raise SchedulerError('BicPAMS runs are scheduled with POSIX file locks, not available on this platform')
+        job_id = job_id or current_job['job_id']
+        priority = priority or current_job['priority']
+        self.collect()
+        start = time.perf_counter()
+        name, ticket = self.create_ticket(priority)
+        try:
+            while True:
+                if self.is_cancelled(job_id):
+                    raise JobCancelled('BicPAMS run was cancelled while queued')
+                waiting = self.get_waiting(name)
+                fd = self.try_slot() if waiting and waiting[0] == name else None
+                if fd is not None:
+                    break
+                time.sleep(POLL_INTERVAL)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.get_path('queue', name))
+            os.close(ticket)
+        profiler.record(queue_time=round(time.perf_counter() - start, 4))
+
+        slot = Slot(self, fd, job_id, self.timeout)
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+
+scheduler = None
+scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global scheduler
+    with scheduler_lock:
+        if scheduler is None:
+            scheduler = Scheduler()
+    return scheduler
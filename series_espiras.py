@@ -1,3 +1,26 @@
+import json
+
+import pandas as pd
+from shapely.geometry import mapping
+
+import rollups
+import spatial_index
+from event_store import TIME_COLUMN
+
+
 def get_spatial_series_per_loop(start_date, end_date, granularity, days, geojson):
-    # implementation needs access to the data sources
-    pass
+    # Loop counts per slot of the granularity, one column per loop within the selected geometry
+    loops = spatial_index.get_loops(geojson)
+    counts = rollups.get_series('espiras', start_date, end_date, days, loops, granularity)
+    if counts.empty:
+        return pd.DataFrame(), pd.DataFrame(columns=['espira', 'coordinates'])
+
+    time_series = counts.pivot(index=TIME_COLUMN, columns='espira', values='count')
+    time_series.index.name = None
+    time_series.columns = [str(loop) for loop in time_series.columns]
+
+    found = list(dict.fromkeys(counts['espira']))
+    locations = pd.DataFrame({
+        'espira': found,
+        'coordinates': [json.dumps(mapping(spatial_index.get_loop_geometry(loop))['coordinates']) for loop in found]})
+    return time_series, locations
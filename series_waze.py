@@ -1,3 +1,13 @@
+from event_store import TIME_COLUMN
+
+# Columns of the rolled up jams behind each attribute of the series
+ATTRIBUTES = {'speed': 'speed', 'delay': 'delay', 'spatial_extension': 'length'}
+
+
 def get_event_series(events_per_street, granularity, geojson):
-    # implementation needs access to the data sources
-    pass
+    # Jams already aggregated per slot (rollups.py) as speed_<street>, delay_<street> and spatial_extension_<street>
+    per_slot = events_per_street.pivot(index=TIME_COLUMN, columns='street_name', values=list(ATTRIBUTES.values()))
+    names = {column: attribute for attribute, column in ATTRIBUTES.items()}
+    per_slot.columns = ['{}_{}'.format(names[column], street) for column, street in per_slot.columns]
+    per_slot.index.name = None
+    return per_slot, 'waze'
@@ -0,0 +1,123 @@
+'''
+@info server-side store for datasets and biclusters shared between callbacks
+@author Francisco Neves
+@version 1.0
+'''
+
+import os
+import pickle
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+
+SESSIONS_PATH = str(os.path.abspath(os.path.dirname(__file__))) + '/data/sessions/'
+MAX_ITEMS = int(os.environ.get('ROADPM_SESSION_ITEMS', 16))
+MAX_SPILLED_BYTES = int(os.environ.get('ROADPM_SESSION_SPILLED_BYTES', 2 * 1024 ** 3))
+
+
+def is_token(token):
+    # Tokens only contain hex digits, anything else cannot have been issued by this store
+    return bool(token) and all(char in '0123456789abcdef' for char in token)
+
+
+class SessionStore:
+    def __init__(self, directory, max_items=MAX_ITEMS, max_spilled_bytes=MAX_SPILLED_BYTES):
+        self.directory = directory
+        self.max_items = max_items
+        self.max_spilled_bytes = max_spilled_bytes
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, token):
+        return os.path.join(self.directory, token + '.pkl')
+
+    def get_file_path(self, token, extension):
+        # Files stored next to a value share its token and are evicted with it
+        return os.path.join(self.directory, token + extension)
+
+    def put(self, value, token=None, keep=()):
+        # Written through to disk, callbacks of the same session may be served by another web process.
+        # Tokens in keep (e.g. the series of the same result) are not evicted to make room for this one
+        token = token or uuid.uuid4().hex
+        self.spill(token, value, keep)
+        self.cache(token, value)
+        return token
+
+    def cache(self, token, value):
+        # The most recently used values are also kept in memory, dropping one never loses it
+        with self.lock:
+            self.items[token] = value
+            self.items.move_to_end(token)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+    def get(self, token):
+        if not is_token(token):
+            return None
+        with self.lock:
+            value = self.items.get(token)
+            if value is not None:
+                self.items.move_to_end(token)
+        if value is None:
+            try:
+                with open(self.get_path(token), 'rb') as f:
+                    value = pickle.load(f)
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                return None
+            self.cache(token, value)
+        self.touch(token)
+        return value
+
+    def touch(self, token):
+        # Values still being read by a session are the last to be evicted
+        try:
+            os.utime(self.get_path(token))
+        except FileNotFoundError:
+            pass
+
+    def spill(self, token, value, keep=()):
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f.name, self.get_path(token))
+        self.evict_spilled({token, *keep})
+
+    def evict_spilled(self, keep=()):
+        # A token and the files stored next to it are evicted together, least recently used first (newest file),
+        # until the store fits its budget. Files left without a value by a process that died are evicted too
+        mtimes, sizes, files = {}, {}, {}
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                token = entry.name.partition('.')[0]
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.setdefault(token, []).append(entry.path)
+                mtimes[token] = max(stat.st_mtime, mtimes.get(token, stat.st_mtime))
+                sizes[token] = sizes.get(token, 0) + stat.st_size
+        total = sum(sizes.values())
+        for _, token in sorted((mtime, token) for token, mtime in mtimes.items()):
+            if total <= self.max_spilled_bytes:
+                break
+            if token in keep:
+                continue
+            for path in files[token]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= sizes[token]
+
+
+session_store = None
+session_store_lock = threading.Lock()
+
+
+def get_session_store():
+    global session_store
+    with session_store_lock:
+        if session_store is None:
+            session_store = SessionStore(SESSIONS_PATH)
+    return session_store
@@ -0,0 +1,129 @@
+'''
+@info spatial index over loop detectors and street segments for the geometries drawn on the map
+@author Francisco Neves
+@version 1.0
+'''
+
+import hashlib
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import shapely
+from shapely.geometry import shape
+from shapely.ops import transform
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+
+DATA_PATH = str(os.path.abspath(os.path.dirname(__file__))) + '/data/'
+LOOPS_PATH = os.environ.get('ROADPM_LOOPS_GEOJSON', DATA_PATH + 'espiras.geojson')
+STREETS_PATH = os.environ.get('ROADPM_STREETS_GEOJSON', DATA_PATH + 'streets.geojson')
+# Shapely 2 queries return positions in the tree, earlier versions return the geometries themselves
+SHAPELY_2 = int(shapely.__version__.split('.')[0]) >= 2
+# Meters around drawn geometries, a drawn line or point hardly ever touches a street or loop exactly
+DEFAULT_BUFFERS = {'Point': 50, 'MultiPoint': 50, 'LineString': 30, 'MultiLineString': 30}
+MAX_CACHED_QUERIES = 256
+METERS_PER_DEGREE = 111320
+
+
+def to_meters(geometry, latitude):
+    # Local equirectangular projection, accurate enough for buffers of a few hundred meters within a city
+    scale = math.cos(math.radians(latitude)) * METERS_PER_DEGREE
+    return transform(lambda x, y, z=None: (x * scale, y * METERS_PER_DEGREE), geometry)
+
+
+def to_degrees(geometry, latitude):
+    scale = math.cos(math.radians(latitude)) * METERS_PER_DEGREE
+    return transform(lambda x, y, z=None: (x / scale, y / METERS_PER_DEGREE), geometry)
+
+
+def buffer_geometry(geometry, meters):
+    if not meters:
+        return geometry
+    latitude = geometry.centroid.y
+    return to_degrees(to_meters(geometry, latitude).buffer(meters), latitude)
+
+
+def get_geometry_hash(geojson, buffer):
+    return hashlib.sha256(json.dumps([geojson, buffer], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class SpatialIndex:
+    def __init__(self, ids, geometries):
+        self.ids = list(ids)
+        self.geometries = list(geometries)
+        self.tree = STRtree(self.geometries)
+        self.positions = {id(geometry): i for i, geometry in enumerate(self.geometries)}
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_geometry(self, location_id):
+        # First geometry of a location, streets made of several segments are drawn from the first one
+        return self.geometries[self.ids.index(location_id)]
+
+    def query_positions(self, geometry):
+        if SHAPELY_2:
+            return sorted(self.tree.query(geometry, predicate='intersects').tolist())
+        # The tree only filters by bounding box, candidates are then tested against the actual geometry
+        prepared = prep(geometry)
+        return sorted(self.positions[id(candidate)] for candidate in self.tree.query(geometry) if
+                      prepared.intersects(candidate))
+
+    def query(self, geojson, buffer=None):
+        # Ids of the locations intersecting a GeoJSON geometry in WGS84, grown by buffer meters
+        if buffer is None:
+            buffer = DEFAULT_BUFFERS.get(geojson['type'], 0)
+        key = get_geometry_hash(geojson, buffer)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return list(self.cache[key])
+
+        # Street segments share the street id, each id is listed once
+        positions = self.query_positions(buffer_geometry(shape(geojson), buffer))
+        ids = list(dict.fromkeys(self.ids[i] for i in positions))
+        with self.lock:
+            self.cache[key] = ids
+            while len(self.cache) > MAX_CACHED_QUERIES:
+                self.cache.popitem(last=False)
+        return list(ids)
+
+
+def load_index(path, id_property):
+    # GeoJSON feature collection with the location id in the feature properties
+    with open(path) as f:
+        features = json.load(f)['features']
+    return SpatialIndex([feature['properties'][id_property] for feature in features],
+                        [shape(feature['geometry']) for feature in features])
+
+
+indexes = {}
+indexes_lock = threading.Lock()
+
+
+def get_index(path, id_property):
+    with indexes_lock:
+        if path not in indexes:
+            indexes[path] = load_index(path, id_property)
+    return indexes[path]
+
+
+def get_loops(geojson, buffer=None):
+    return get_index(LOOPS_PATH, 'espira').query(geojson, buffer)
+
+
+def get_streets(geojson, buffer=None):
+    return get_index(STREETS_PATH, 'street_name').query(geojson, buffer)
+
+
+def get_loop_geometry(loop):
+    return get_index(LOOPS_PATH, 'espira').get_geometry(loop)
+
+
+def get_street_geometry(street):
+    return get_index(STREETS_PATH, 'street_name').get_geometry(street)
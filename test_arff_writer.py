@@ -0,0 +1,52 @@
+'''
+@info ARFF export of the transaction matrix, against the file liac-arff writes for the same data
+@author Francisco Neves
+@version 1.0
+'''
+
+import io
+import unittest
+
+import numpy as np
+
+import arff_writer
+
+try:
+    import arff
+except ImportError:
+    arff = None
+
+COLUMNS = ['speed', 'Av. da Liberdade', 'x%y', 'a,b', '{c}', "d'e", 'f"g', 'h\\i', 'j@NUMERIC']
+VALUES = np.array([[1.0, np.nan, 2.5, 1e-07, 3.0, 0.1, -2.0, 1e+20, 5.0],
+                   [0.0, 0.5, np.nan, 12.0, -0.0, 1 / 3, 7.25, 2.0, np.nan]])
+
+
+def write_arff(columns, values, chunk_size=arff_writer.CHUNK_SIZE):
+    f = io.StringIO()
+    arff_writer.write_arff(f, columns, values, chunk_size=chunk_size)
+    return f.getvalue()
+
+
+class ArffWriterTest(unittest.TestCase):
+    def test_header(self):
+        header = write_arff(COLUMNS, VALUES).split('@DATA')[0].splitlines()
+        self.assertEqual(header[2:11], [
+            '@ATTRIBUTE speed NUMERIC', '@ATTRIBUTE "Av. da Liberdade" NUMERIC', '@ATTRIBUTE "x%y" NUMERIC',
+            '@ATTRIBUTE "a,b" NUMERIC', '@ATTRIBUTE "{c}" NUMERIC', "@ATTRIBUTE d'e NUMERIC",
+            '@ATTRIBUTE f"g NUMERIC', '@ATTRIBUTE h\\i NUMERIC', '@ATTRIBUTE j@NUMERIC NUMERIC'])
+
+    def test_chunks(self):
+        self.assertEqual(write_arff(COLUMNS, VALUES, chunk_size=1), write_arff(COLUMNS, VALUES))
+
+    @unittest.skipIf(arff is None, 'liac-arff is not installed')
+    def test_liac_arff(self):
+        # The data the jar read before, written by arff2pandas through liac-arff
+        expected = io.StringIO()
+        arff.dump({'relation': 'data', 'attributes': [(column, 'NUMERIC') for column in COLUMNS],
+                   'data': [[None if np.isnan(value) else value for value in row] for row in VALUES.tolist()]},
+                  expected)
+        self.assertEqual(write_arff(COLUMNS, VALUES), expected.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
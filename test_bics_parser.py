@@ -0,0 +1,51 @@
+'''
+@info regression test of the .bics parser against the original regex parser and the sizes in the headers, on the
+      outputs kept under data/bics/
+@author Francisco Neves
+@version 1.0
+'''
+
+import glob
+import os
+import re
+import unittest
+
+from benchmark import check_bics_parser
+from roadpm_utils import parse_bics_from_file
+
+BICS_PATH = str(os.path.abspath(os.path.dirname(__file__))) + '/data/bics/'
+# Header sizes are (columns,rows)
+BICS_SHAPE = re.compile(r'I=\[.*\] \((\d+),(\d+)\) Y=')
+
+
+def get_bics_files():
+    return sorted(glob.glob(os.path.join(BICS_PATH, '*.bics')))
+
+
+class BicsParserTest(unittest.TestCase):
+    def test_bics_files(self):
+        self.assertTrue(get_bics_files(), 'No .bics files under {}'.format(BICS_PATH))
+
+    def test_matches_legacy_parser(self):
+        for file_path in get_bics_files():
+            with self.subTest(file=os.path.basename(file_path)):
+                bics, _, _ = check_bics_parser(file_path)
+                self.assertTrue(bics)
+
+    def test_matrix_shapes(self):
+        # Both matrices hold every row and column of the header
+        for file_path in get_bics_files():
+            with self.subTest(file=os.path.basename(file_path)):
+                with open(file_path) as f:
+                    shapes = [tuple(int(size) for size in reversed(match.groups())) for match in
+                              map(BICS_SHAPE.search, f) if match]
+                bics = parse_bics_from_file(file_path)
+                self.assertEqual(len(shapes), len(bics))
+                for shape, bic in zip(shapes, bics):
+                    self.assertEqual(shape, (len(bic.rows), len(bic.cols)))
+                    self.assertEqual(bic.real_matrix.shape, shape)
+                    self.assertEqual(bic.matrix.shape, shape)
+                    self.assertEqual(bic.area, shape[0] * shape[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+'''
+@info round trip of uploaded CSV files through the columnar ingestion cache, against pd.read_csv
+@author Francisco Neves
+@version 1.0
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+import ingestion
+
+
+class IngestionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write_csv(self, contents):
+        csv_file = os.path.join(self.directory, 'dataset.csv')
+        with open(csv_file, 'w') as f:
+            f.write(contents)
+        return csv_file
+
+    def assert_round_trip(self, csv_file, columns=None):
+        expected = pd.read_csv(csv_file, parse_dates=True, index_col=[0])
+        if columns is not None:
+            expected = expected[columns]
+        cache = os.path.join(self.directory, 'ingest')
+        # Converted on the first read, read back from the cache on the second
+        for _ in range(2):
+            pd.testing.assert_frame_equal(ingestion.read_csv(csv_file, columns, cache), expected)
+
+    def test_time_zone_index(self):
+        csv_file = self.write_csv('time,speed_08:00\n'
+                                  '2018-10-01 08:00:00+01:00,42.5\n'
+                                  '2018-10-02 08:00:00+01:00,37.0\n'
+                                  '2018-10-03 08:00:00+01:00,\n')
+        self.assert_round_trip(csv_file)
+        self.assertEqual(ingestion.read_csv(csv_file, directory=os.path.join(self.directory, 'ingest')).index.strftime(
+            '%Y-%m-%d %H:%M').tolist(), ['2018-10-01 08:00', '2018-10-02 08:00', '2018-10-03 08:00'])
+
+    def test_naive_index(self):
+        csv_file = self.write_csv('time,delay_08:00\n2018-10-01,120\n2018-10-02,0\n')
+        self.assert_round_trip(csv_file)
+
+    def test_missing_text(self):
+        csv_file = self.write_csv('time,street,speed_08:00\n'
+                                  '2018-10-01,Avenida da Liberdade,42.5\n'
+                                  '2018-10-02,,37.0\n'
+                                  '2018-10-03,nan,12.0\n')
+        self.assert_round_trip(csv_file)
+        self.assert_round_trip(csv_file, ['street'])
+
+
+if __name__ == '__main__':
+    unittest.main()
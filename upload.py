@@ -0,0 +1,221 @@
+'''
+@info chunked upload of large CSV files, streamed to disk with the header validated on the first chunk
+@author Francisco Neves
+@version 1.0
+'''
+
+import csv
+import io
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+import dash_html_components as html
+from flask import Blueprint, jsonify, request
+
+import ingestion
+
+UPLOADS_PATH = str(os.path.abspath(os.path.dirname(__file__))) + '/data/uploads/'
+DATASETS_PATH = str(os.path.abspath(os.path.dirname(__file__))) + '/data/'
+MAX_UPLOAD_SIZE = int(os.environ.get('ROADPM_UPLOAD_MAX_SIZE', 4 * 1024 ** 3))
+MAX_CHUNK_SIZE = 16 * 1024 ** 2
+MAX_HEADER_SIZE = 1024 ** 2
+BLOCK_SIZE = 1024 ** 2
+UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+FILENAME = re.compile(r'^[\w.-]+\.csv$')
+# Uploads not written to for this many seconds are abandoned and their partial files removed
+MAX_AGE = int(os.environ.get('ROADPM_UPLOAD_MAX_AGE', 24 * 3600))
+COLLECT_INTERVAL = 60
+
+last_collect = {}
+collect_lock = threading.Lock()
+
+blueprint = Blueprint('upload', __name__)
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def get_paths(upload_id):
+    if not UPLOAD_ID.match(upload_id or ''):
+        raise UploadError('Unknown upload', 404)
+    part, state = os.path.join(UPLOADS_PATH, upload_id + '.part'), os.path.join(UPLOADS_PATH, upload_id + '.json')
+    if not os.path.exists(state):
+        raise UploadError('Unknown upload', 404)
+    return part, state
+
+
+def read_state(state_file):
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def write_state(state_file, state):
+    with open(state_file + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(state_file + '.tmp', state_file)
+
+
+def parse_header(line):
+    # An index column, possibly unnamed, followed by uniquely named attribute columns
+    columns = next(csv.reader(io.StringIO(line.decode('utf-8-sig').rstrip('\r\n'))), [])
+    attributes = columns[1:]
+    if not attributes:
+        raise UploadError('The file needs an index column and at least one attribute column')
+    if any(not attribute.strip() for attribute in attributes):
+        raise UploadError('Attribute columns must be named')
+    if len(set(attributes)) != len(attributes):
+        raise UploadError('Attribute columns must be unique')
+    return attributes
+
+
+def get_int_arg(name, default):
+    try:
+        return int(request.args.get(name, default))
+    except ValueError:
+        raise UploadError('{} must be an integer'.format(name))
+
+
+def remove(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def collect(directory=UPLOADS_PATH, max_age=MAX_AGE, force=False):
+    # Runs at most once a minute per process, like the collection of workspaces
+    now = time.time()
+    with collect_lock:
+        if not force and now - last_collect.get(directory, 0) < COLLECT_INTERVAL:
+            return 0
+        last_collect[directory] = now
+
+    removed = 0
+    if not os.path.isdir(directory):
+        return removed
+    with os.scandir(directory) as it:
+        for entry in it:
+            # Every chunk appended to the .part file refreshes its mtime, the state file is written rarely
+            upload_id = entry.name.split('.', 1)[0]
+            part = os.path.join(directory, upload_id + '.part')
+            try:
+                mtime = os.path.getmtime(part if os.path.exists(part) else entry.path)
+                if UPLOAD_ID.match(upload_id) and now - mtime > max_age:
+                    remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                # Finished or removed by another process meanwhile
+                pass
+    return removed
+
+
+@blueprint.errorhandler(UploadError)
+def handle_upload_error(e):
+    return jsonify({'error': str(e)}), e.status
+
+
+@blueprint.route('/upload/start', methods=['POST'])
+def start_upload():
+    filename = os.path.basename(request.args.get('filename', ''))
+    if not FILENAME.match(filename):
+        raise UploadError('Only .csv files with letters, digits, dots, dashes and underscores in the name')
+    if get_int_arg('size', 0) > MAX_UPLOAD_SIZE:
+        raise UploadError('File is larger than {} bytes'.format(MAX_UPLOAD_SIZE), 413)
+
+    os.makedirs(UPLOADS_PATH, exist_ok=True)
+    collect()
+    upload_id = uuid.uuid4().hex
+    open(os.path.join(UPLOADS_PATH, upload_id + '.part'), 'wb').close()
+    write_state(os.path.join(UPLOADS_PATH, upload_id + '.json'), {'filename': filename, 'columns': None})
+    return jsonify({'upload_id': upload_id})
+
+
+@blueprint.route('/upload/<upload_id>/chunk', methods=['POST'])
+def upload_chunk(upload_id):
+    part, state_file = get_paths(upload_id)
+    state = read_state(state_file)
+    size = os.path.getsize(part)
+    # Chunks are appended in order, a client retrying a chunk resumes from the reported size
+    if get_int_arg('offset', -1) != size:
+        return jsonify({'error': 'Unexpected offset', 'size': size}), 409
+    if (request.content_length or 0) > MAX_CHUNK_SIZE:
+        raise UploadError('Chunk is larger than {} bytes'.format(MAX_CHUNK_SIZE), 413)
+
+    with open(part, 'ab') as f:
+        while True:
+            block = request.stream.read(BLOCK_SIZE)
+            if not block:
+                break
+            size += len(block)
+            if size > MAX_UPLOAD_SIZE:
+                f.close()
+                remove(part, state_file)
+                raise UploadError('File is larger than {} bytes'.format(MAX_UPLOAD_SIZE), 413)
+            f.write(block)
+
+    if state['columns'] is None:
+        with open(part, 'rb') as f:
+            header = f.readline(MAX_HEADER_SIZE + 1)
+        if header.endswith(b'\n') or len(header) > MAX_HEADER_SIZE:
+            try:
+                if len(header) > MAX_HEADER_SIZE:
+                    raise UploadError('Header line is too long')
+                state['columns'] = parse_header(header)
+            except (UploadError, UnicodeDecodeError) as e:
+                remove(part, state_file)
+                raise UploadError('Invalid header: {}'.format(e))
+            write_state(state_file, state)
+
+    return jsonify({'size': size, 'columns': state['columns']})
+
+
+@blueprint.route('/upload/<upload_id>/finish', methods=['POST'])
+def finish_upload(upload_id):
+    part, state_file = get_paths(upload_id)
+    state = read_state(state_file)
+    if state['columns'] is None:
+        with open(part, 'rb') as f:
+            state['columns'] = parse_header(f.readline(MAX_HEADER_SIZE))
+
+    # Prefixed with the upload id, an upload never replaces another dataset or a file a job is reading
+    path = os.path.join(DATASETS_PATH, '{}-{}'.format(upload_id, state['filename']))
+    os.replace(part, path)
+    remove(state_file)
+
+    # Converted ahead of the first run so that it does not have to parse the CSV
+    threading.Thread(target=ingestion.get_entry, args=(path,), daemon=True).start()
+    return jsonify({'path': path, 'columns': state['columns']})
+
+
+@blueprint.route('/upload/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    remove(*get_paths(upload_id))
+    return jsonify({})
+
+
+def register(server):
+    if 'upload' not in server.blueprints:
+        server.register_blueprint(blueprint)
+
+
+def get_upload_component(component_id, target_id):
+    # Handled by assets/chunked_upload.js, which writes the uploaded file path into the target input.
+    # The progress element is written only by the script, the status one is the output of a dash callback
+    return html.Div([
+        html.Div(['Drag and Drop or ', html.A('Select Files')], id=component_id + '_zone', className='chunked-upload',
+                 style={'width': '100%', 'height': '60px', 'lineHeight': '60px', 'borderWidth': '1px',
+                        'borderStyle': 'dashed', 'borderRadius': '5px', 'textAlign': 'center', 'cursor': 'pointer'},
+                 **{'data-target': target_id}),
+        html.Div(id=component_id + '_progress', className='chunked-upload-progress',
+                 style={'textOverflow': 'ellipsis', 'overflow': 'hidden'}),
+        html.Div(id=component_id + '_output', className='chunked-upload-status',
+                 style={'textOverflow': 'ellipsis', 'overflow': 'hidden'})
+    ])
@@ -0,0 +1,111 @@
+'''
+@info private working directories for jobs, so concurrent runs in any number of processes never share files
+@author Francisco Neves
+@version 1.0
+'''
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+WORKSPACES_PATH = os.environ.get('ROADPM_WORKSPACES_PATH',
+                                 str(os.path.abspath(os.path.dirname(__file__))) + '/data/workspaces/')
+# Workspaces left behind are removed once their process is gone, or after this many seconds in any case
+MAX_AGE = int(os.environ.get('ROADPM_WORKSPACE_MAX_AGE', 24 * 3600))
+COLLECT_INTERVAL = 60
+OWNER_FILE = 'owner.json'
+
+last_collect = {}
+collect_lock = threading.Lock()
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def is_abandoned(path, now, max_age=MAX_AGE):
+    try:
+        with open(os.path.join(path, OWNER_FILE)) as f:
+            owner = json.load(f)
+    except (OSError, ValueError):
+        # Being created, or its owner died before writing it
+        return now - os.path.getmtime(path) > COLLECT_INTERVAL
+    if now - owner['created'] > max_age:
+        return True
+    # Processes of other hosts sharing the directory can not be checked, only their age
+    return owner['host'] == socket.gethostname() and not is_running(owner['pid'])
+
+
+def collect(directory=WORKSPACES_PATH, max_age=MAX_AGE, force=False):
+    # Runs at most once a minute per process, workspaces are created at every run
+    now = time.time()
+    with collect_lock:
+        if not force and now - last_collect.get(directory, 0) < COLLECT_INTERVAL:
+            return 0
+        last_collect[directory] = now
+
+    removed = 0
+    if not os.path.isdir(directory):
+        return removed
+    with os.scandir(directory) as it:
+        for entry in it:
+            try:
+                if entry.is_dir() and is_abandoned(entry.path, now, max_age):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    removed += 1
+            except FileNotFoundError:
+                # Removed by its owner or another process meanwhile
+                pass
+    return removed
+
+
+def publish(source, target):
+    # Readers of target only ever see a complete file, of concurrent publishers the last one wins
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.replace(source, target)
+    except OSError:
+        # Another file system, the copy is renamed into place instead
+        tmp = '{}.{}.tmp'.format(target, uuid.uuid4().hex)
+        try:
+            shutil.copyfile(source, tmp)
+            os.replace(tmp, target)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return target
+
+
+class Workspace:
+    def __init__(self, directory=WORKSPACES_PATH):
+        collect(directory)
+        os.makedirs(directory, exist_ok=True)
+        self.path = tempfile.mkdtemp(dir=directory, prefix='{}-'.format(os.getpid()))
+        with open(os.path.join(self.path, OWNER_FILE), 'w') as f:
+            json.dump({'host': socket.gethostname(), 'pid': os.getpid(), 'created': time.time()}, f)
+
+    def get_path(self, filename):
+        return os.path.join(self.path, filename)
+
+    def publish(self, filename, target):
+        return publish(self.get_path(filename), target)
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()